@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+同步基线 - 负责记录每个文件上次成功同步时的状态，用于三方比较
+"""
+
+import sqlite3
+import threading
+from .config_manager import get_state_path
+from .snapshot import FileSnapshot
+
+# 累计多少次写入后提交一次
+COMMIT_INTERVAL = 1000
+
+class BaselineStore:
+    """上次成功同步时每个文件的 hash、大小、本地修改时间和服务器修改时间（SQLite）
+
+    镜像模式用它区分“只有一边修改”和“两边都修改”：本地和服务器的修改时间分别与各自上次的值比较，
+    不再跨两个时钟比较新旧；一边删除而另一边未修改时同步删除。
+    只有镜像模式维护基线，其他模式同步后基线失效（见 discard）。
+    """
+
+    def __init__(self, server_url, local_folder):
+        self.db_file = get_state_path('baseline', server_url.rstrip('/'), str(local_folder), suffix='.db')
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.db_file), check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS baseline ('
+            'path TEXT PRIMARY KEY, hash TEXT, size INTEGER, local_mtime INTEGER, server_mtime INTEGER)'
+        )
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY)')
+        self.conn.commit()
+        self.pending = 0
+
+    @staticmethod
+    def discard(server_url, local_folder):
+        """删除基线（以单向模式同步后基线不再可信）"""
+        db_file = get_state_path('baseline', server_url.rstrip('/'), str(local_folder), suffix='.db')
+        try:
+            if db_file.exists():
+                db_file.unlink()
+        except OSError:
+            pass
+
+    def _written(self):
+        """记录一次写入，累计到一定数量时提交"""
+        self.pending += 1
+        if self.pending >= COMMIT_INTERVAL:
+            self.conn.commit()
+            self.pending = 0
+
+    def get(self, path):
+        """返回文件的基线 {'hash', 'size', 'local_mtime', 'server_mtime'}，没有时返回None"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT hash, size, local_mtime, server_mtime FROM baseline WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+        return {'hash': row[0], 'size': row[1], 'local_mtime': row[2], 'server_mtime': row[3]}
+
+    def put(self, path, file_hash, size, local_mtime, server_mtime):
+        """记录文件同步后的状态"""
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO baseline VALUES (?, ?, ?, ?, ?)',
+                              (path, file_hash, size, local_mtime, server_mtime))
+            self._written()
+
+    def remove(self, path):
+        """文件已在两边删除"""
+        with self.lock:
+            self.conn.execute('DELETE FROM baseline WHERE path = ?', (path,))
+            self._written()
+
+    def begin_seen(self):
+        """开始记录本轮同步见到的路径"""
+        with self.lock:
+            self.conn.execute('DELETE FROM seen')
+
+    def mark_seen(self, path):
+        """记录本轮同步中本地或服务器存在的路径"""
+        with self.lock:
+            self.conn.execute('INSERT OR IGNORE INTO seen VALUES (?)', (path,))
+
+    def mark_seen_many(self, paths):
+        """批量记录本轮同步中存在的路径"""
+        with self.lock:
+            self.conn.executemany('INSERT OR IGNORE INTO seen VALUES (?)', ((path,) for path in paths))
+
+    def snapshots(self, table):
+        """以列式快照返回全部基线：(本地一侧, 服务器一侧)，两者只有修改时间列不同"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT path, hash, size, local_mtime, server_mtime FROM baseline').fetchall()
+        local = FileSnapshot.build(table, ((path, size, local_mtime, file_hash)
+                                           for path, file_hash, size, local_mtime, _ in rows))
+        return local, local.with_mtimes(row[4] for row in rows)
+
+    def prune_unseen(self, scope='', pruned=()):
+        """删除同步范围内两边都已不存在的路径的基线，返回删除的数量"""
+        def under(base, path):
+            return not base or path == base or path.startswith(base + '/')
+
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT path FROM baseline WHERE path NOT IN (SELECT path FROM seen)').fetchall()
+            stale = [(path,) for (path,) in rows
+                     if under(scope, path) and not any(under(p, path) for p in pruned)]
+            self.conn.executemany('DELETE FROM baseline WHERE path = ?', stale)
+            self.conn.execute('DELETE FROM seen')
+            self.conn.commit()
+            self.pending = 0
+        return len(stale)
+
+    def rows(self):
+        """返回所有基线记录（用于录制）"""
+        with self.lock:
+            return self.conn.execute('SELECT * FROM baseline').fetchall()
+
+    def commit(self):
+        """提交尚未保存的修改"""
+        with self.lock:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        """提交并关闭数据库"""
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
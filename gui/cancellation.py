@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+取消与暂停 - 负责在扫描、列表获取和传输过程中及时响应停止/暂停
+"""
+
+import threading
+
+class SyncCancelled(Exception):
+    """同步已被停止"""
+
+class CancelToken:
+    """协作式取消令牌
+
+    扫描、hash计算和传输在处理每个条目/数据块时调用 check()：
+    已停止时抛出 SyncCancelled，已暂停时阻塞到继续或停止为止，因此暂停后可以接着执行当前计划。
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self):
+        return not self._resumed.is_set()
+
+    def cancel(self):
+        """停止：唤醒所有等待中的线程"""
+        self._cancelled.set()
+        self._resumed.set()
+
+    def pause(self):
+        """暂停"""
+        self._resumed.clear()
+
+    def resume(self):
+        """继续"""
+        self._resumed.set()
+
+    def check(self):
+        """检查点：已停止时抛出 SyncCancelled，暂停时等待继续"""
+        if self._cancelled.is_set():
+            raise SyncCancelled()
+        if not self._resumed.is_set():
+            self._resumed.wait()
+            if self._cancelled.is_set():
+                raise SyncCancelled()
+
+    def sleep(self, seconds):
+        """可被停止打断的等待，返回是否仍在运行"""
+        return not self._cancelled.wait(seconds)
+
+class CancellableReader:
+    """包装上传用的文件对象，每读取一个数据块检查一次取消令牌
+
+    on_read 不为空时每读到一个数据块就调用一次（例如边上传边计算hash）。
+    chunk_size 为每次至少读取的字节数（http.client 每次只请求8KB，放大后减少调用次数）。
+    """
+
+    def __init__(self, fileobj, token, size, on_read=None, chunk_size=None):
+        self.fileobj = fileobj
+        self.token = token
+        self.size = size
+        self.on_read = on_read
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        self.token.check()
+        if self.chunk_size and 0 <= size < self.chunk_size:
+            size = self.chunk_size
+        data = self.fileobj.read(size)
+        if self.on_read and data:
+            self.on_read(data)
+        return data
@@ -6,11 +6,21 @@
 
 import json
 import os
+import hashlib
 from pathlib import Path
 
+CONFIG_DIR = Path.home() / '.dufs_sync'
+
+def get_state_path(prefix, *keys, suffix='.json'):
+    """根据服务器地址等键值生成状态文件路径（保存在配置目录的state子目录下）"""
+    digest = hashlib.sha1('|'.join(keys).encode('utf-8')).hexdigest()[:16]
+    state_dir = CONFIG_DIR / 'state'
+    state_dir.mkdir(parents=True, exist_ok=True)
+    return state_dir / f"{prefix}_{digest}{suffix}"
+
 class ConfigManager:
     def __init__(self):
-        self.config_dir = Path.home() / '.dufs_sync'
+        self.config_dir = CONFIG_DIR
         self.config_file = self.config_dir / 'config.json'
         
         # 确保配置目录存在
@@ -28,10 +38,45 @@ class ConfigManager:
         # 返回默认配置
         return {
             'server_url': 'http://127.0.0.1:5001',
+            'extra_server_urls': [],
             'local_folder': '',
             'exclude_rules': ['~$*', '*.tmp', '*.log', '.DS_Store', 'Thumbs.db'],
             'sync_interval': 30,
+            'subtree_rules': [],
+            'full_walk_interval': 600,
+            'listing_strategy': 'auto',
+            'search_listing_queries': ['.'],
+            'streaming_diff': False,
+            'columnar_diff': True,
+            'detect_moves': True,
+            'dedup_uploads': True,
+            'hash_while_upload': True,
+            'verify_uploads': True,
+            'upload_transport': 'requests',
+            'local_reuse_mode': 'copy',
+            'journal_enabled': True,
+            'trace_file': '',
+            'transfer_workers': 1,
+            'transfer_chunk_kb': 1024,
+            'request_timeout': 30,
+            'link_probe': {},
+            'schedule_small_first': True,
+            'schedule_recent_first': False,
+            'schedule_priority_patterns': [],
+            'large_file_threshold': 64 * 1024 * 1024,
+            'large_lane_ratio': 10,
+            'background_priority': 'normal',
+            'hash_read_limit_mb': 0,
+            'pause_load_threshold': 0,
+            'log_level': 'info',
+            'log_to_file': True,
+            'log_file': '',
+            'log_file_level': 'info',
+            'log_file_max_mb': 10,
+            'log_file_backups': 3,
             'sync_mode': 'mirror',
+            'use_baseline': True,
+            'keep_conflict_copies': True,
             'username': '',
             'password': ''
         }
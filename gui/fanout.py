@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多服务器同步 - 负责把同一个本地文件夹同步到多个dufs服务器
+"""
+
+import time
+import threading
+from urllib.parse import urlparse
+from .sync_engine import SyncEngine
+from .cancellation import SyncCancelled
+from .hash_state import HashState
+from .sync_events import LogMessage
+
+def get_target_urls(config):
+    """返回同步目标服务器列表（主服务器在前，去掉重复和空地址）"""
+    urls = []
+    for url in [config.get('server_url', '')] + list(config.get('extra_server_urls', [])):
+        url = (url or '').strip()
+        if url and url.rstrip('/') not in [u.rstrip('/') for u in urls]:
+            urls.append(url)
+    return urls
+
+class LocalSnapshot:
+    """多个目标共享的本地扫描结果
+
+    每个目标同步时先取本地文件列表：如果在它上次取用之后已经有其他目标扫描过，
+    直接复用那次的结果（包括hash），否则由它重新扫描一次。扫描在锁内进行，
+    同时开始的目标等待第一个目标扫描完成后复用结果，本地文件夹每轮只扫描和计算hash一次。
+    目标自己在那次扫描开始之后写入或删除过本地文件（engine.last_local_write）时，
+    扫描结果不包含这些变化，也要重新扫描。
+    """
+
+    def __init__(self, hash_state):
+        self.lock = threading.Lock()
+        self.hash_state = hash_state
+        self.version = 0
+        # (子目录, 跳过的下级子目录) -> (版本, 文件列表, 本地内容索引, 扫描是否完整, 扫描开始时间)
+        self.entries = {}
+
+    def get(self, engine):
+        """返回 (文件列表, 本地内容索引)，必要时用 engine 重新扫描"""
+        key = (engine.scope, engine.pruned)
+        with self.lock:
+            cached = self.entries.get(key)
+            if (cached is None or cached[0] <= engine.snapshot_versions.get(key, 0)
+                    or engine.last_local_write >= cached[4]):
+                started = time.time()
+                files = list(engine.scan_local_files())
+                self.version += 1
+                cached = (self.version, files, engine.local_hash_index, engine._local_complete, started)
+                self.entries[key] = cached
+            engine.snapshot_versions[key] = cached[0]
+            engine._local_complete = cached[3]
+            return cached[1], cached[2]
+
+class FanoutSync:
+    """一个同步任务对应多个服务器
+
+    每个服务器使用独立的 SyncEngine（独立的目录缓存、同步日志、计划和传输线程），
+    只共享本地扫描结果，因此某个站点很慢或不可用时不会拖住其他站点。
+    接口与 SyncEngine 相同（start_sync/stop_sync/pause_sync/resume_sync/sync_files）。
+    给出 event_queue 时各目标的事件都进入这个队列，事件的 target 为对应的服务器地址。
+    """
+
+    def __init__(self, config, log_callback=None, stats_callback=None, event_queue=None):
+        self.config = config
+        self.log_callback = log_callback
+        self.stats_callback = stats_callback
+        self.events = event_queue
+        self.snapshot = LocalSnapshot(HashState(config.get('local_folder', '')))
+        self.stats_lock = threading.Lock()
+
+        urls = get_target_urls(config)
+        if config.get('sync_mode', 'mirror') == 'server' and len(urls) > 1:
+            # 多个服务器同时写入同一个本地文件夹会互相覆盖
+            self.log(f"服务器为准模式只能有一个目标，仅同步到 {urls[0]}")
+            urls = urls[:1]
+
+        self.engines = []
+        for url in urls:
+            target_config = dict(config, server_url=url)
+            if config.get('trace_file') and len(urls) > 1:
+                # 每个目标录制到单独的文件
+                target_config['trace_file'] = f"{config['trace_file']}.{self._target_name(url).replace(':', '_')}"
+            engine = SyncEngine(
+                target_config,
+                self._target_log(url),
+                self._target_stats(url),
+                local_snapshot=self.snapshot,
+                event_queue=event_queue
+            )
+            self.engines.append(engine)
+
+        self.stats = {
+            'uploaded': 0,
+            'downloaded': 0,
+            'deleted': 0,
+            'moved': 0,
+            'targets': {engine.config['server_url']: engine.stats for engine in self.engines}
+        }
+
+    @staticmethod
+    def _target_name(url):
+        """日志中显示的目标名称"""
+        return urlparse(url).netloc or url
+
+    def log(self, message):
+        """记录不属于某个目标的消息"""
+        if self.log_callback:
+            self.log_callback(message)
+        if self.events is not None:
+            self.events.put(LogMessage('', 'info', message))
+
+    def _target_log(self, url):
+        """给日志加上目标服务器前缀"""
+        if not self.log_callback:
+            return None
+        name = self._target_name(url)
+        return lambda message: self.log_callback(f"[{name}] {message}")
+
+    def _target_stats(self, url):
+        """汇总各目标的统计信息"""
+        def callback(stats):
+            with self.stats_lock:
+                for key in ('uploaded', 'downloaded', 'deleted', 'moved'):
+                    self.stats[key] = sum(engine.stats.get(key, 0) for engine in self.engines)
+                self.stats['targets'][url] = dict(stats)
+                snapshot = dict(self.stats, targets=dict(self.stats['targets']))
+            if self.stats_callback:
+                self.stats_callback(snapshot)
+        return callback
+
+    def _run_all(self, method_name):
+        """在每个目标各自的线程中运行 SyncEngine 的方法，等待全部结束"""
+        errors = []
+
+        def run(engine):
+            try:
+                getattr(engine, method_name)()
+            except SyncCancelled:
+                pass
+            except Exception as e:
+                errors.append(e)
+                engine.log_callback(f"同步出错: {str(e)}")
+
+        threads = [threading.Thread(target=run, args=(engine,), daemon=True) for engine in self.engines]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def start_sync(self):
+        """启动所有目标的同步循环（各目标按自己的节奏运行）"""
+        self.log(f"同步到 {len(self.engines)} 个服务器: " +
+                 ", ".join(self._target_name(e.config['server_url']) for e in self.engines))
+        self._run_all('start_sync')
+
+    def sync_files(self):
+        """所有目标各执行一次同步"""
+        errors = self._run_all('sync_files')
+        if errors:
+            raise errors[0]
+
+    def stop_sync(self):
+        """停止所有目标"""
+        for engine in self.engines:
+            engine.stop_sync()
+
+    def pause_sync(self):
+        """暂停所有目标"""
+        for engine in self.engines:
+            engine.pause_sync()
+
+    def resume_sync(self):
+        """继续所有目标"""
+        for engine in self.engines:
+            engine.resume_sync()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地hash状态 - 负责记录本地文件已知的hash，未变化的文件不再重新计算
+"""
+
+import os
+import json
+import heapq
+import itertools
+import threading
+from .config_manager import get_state_path
+from .snapshot import FileSnapshot, write_snapshot
+
+class HashState:
+    """保存每个本地文件的 (大小, 修改时间, hash)
+
+    扫描时大小和修改时间都未变化的文件直接使用记录的hash；上传和下载时边传输边计算hash，
+    完成后写入这里，传输过的文件下一轮同步也不需要重新读取。
+    记录以按路径排序的列式快照文件保存（见 snapshot.FileSnapshot）：启动时只做内存映射，
+    查询时二分查找，不把全部记录读成字典；本轮新增/变化的记录放在 changes 中，删除的放在 removed 中，
+    保存时与快照合并写成新文件。旧版本的JSON文件仍可读取。
+    """
+
+    def __init__(self, local_folder):
+        self.state_file = get_state_path('hashes', str(local_folder), suffix='.snap')
+        self.legacy_file = get_state_path('hashes', str(local_folder))
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.changes = {}
+        self.removed = set()
+        self.seen = set()
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        """从磁盘加载记录"""
+        try:
+            if self.state_file.exists():
+                self.snapshot = FileSnapshot.load(self.state_file)
+            elif self.legacy_file.exists():
+                with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                    self.changes = json.load(f).get('files', {})
+                self.dirty = bool(self.changes)
+        except Exception:
+            self.snapshot = None
+            self.changes = {}
+
+    def _entry(self, path):
+        """返回路径当前的记录 [大小, 修改时间, hash]，没有时返回None"""
+        entry = self.changes.get(path)
+        if entry is not None or path in self.removed or self.snapshot is None:
+            return entry
+        index = self.snapshot.find(path)
+        if index < 0:
+            return None
+        return [int(self.snapshot.sizes[index]), self.snapshot.mtime(index), self.snapshot.digest(index)]
+
+    def _rows(self):
+        """按路径顺序产出合并后的全部记录"""
+        stored = ()
+        if self.snapshot is not None:
+            stored = (row for row in self.snapshot.rows()
+                      if row[0] not in self.changes and row[0] not in self.removed)
+        changed = sorted((path, size, mtime, file_hash) for path, (size, mtime, file_hash) in self.changes.items())
+        return heapq.merge(stored, changed, key=lambda row: row[0])
+
+    def save(self):
+        """有变化时保存到磁盘"""
+        with self.lock:
+            if not self.dirty:
+                return
+            tmp_path = f"{self.state_file}.tmp"
+            try:
+                write_snapshot(tmp_path, self._rows())
+                # Windows 不能替换已映射的文件，先释放映射
+                if self.snapshot is not None:
+                    self.snapshot.close()
+                    self.snapshot = None
+                os.replace(tmp_path, self.state_file)
+                self.changes = {}
+                self.removed = set()
+                self.dirty = False
+                if self.legacy_file.exists():
+                    self.legacy_file.unlink()
+            except Exception:
+                pass
+            finally:
+                if self.snapshot is None and self.state_file.exists():
+                    try:
+                        self.snapshot = FileSnapshot.load(self.state_file)
+                    except Exception:
+                        pass
+
+    def get(self, path, size, mtime):
+        """返回记录的hash，文件大小或修改时间变化时返回None"""
+        with self.lock:
+            self.seen.add(path)
+            entry = self._entry(path)
+            if entry and entry[0] == size and entry[1] == mtime:
+                return entry[2]
+            return None
+
+    def put(self, path, size, mtime, file_hash):
+        """记录文件的hash"""
+        with self.lock:
+            self.seen.add(path)
+            if self._entry(path) != [size, mtime, file_hash]:
+                self.changes[path] = [size, mtime, file_hash]
+                self.removed.discard(path)
+                self.dirty = True
+
+    def begin_scan(self):
+        """开始一次本地扫描"""
+        with self.lock:
+            self.seen = set()
+
+    def end_scan(self, scope='', pruned=()):
+        """扫描完整结束：删除范围内已不存在的文件的记录"""
+        def under(base, path):
+            return not base or path == base or path.startswith(base + '/')
+
+        with self.lock:
+            paths = list(self.changes)
+            if self.snapshot is not None:
+                paths = itertools.chain(paths, (self.snapshot.path(index) for index in range(len(self.snapshot))))
+            stale = [path for path in paths
+                     if path not in self.seen and path not in self.removed and under(scope, path)
+                     and not any(under(p, path) for p in pruned)]
+            for path in stale:
+                self.changes.pop(path, None)
+                self.removed.add(path)
+            if stale:
+                self.dirty = True
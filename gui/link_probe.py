@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+链路探测 - 负责测量与服务器之间的延迟和吞吐量，并推荐传输参数
+"""
+
+import os
+import math
+import time
+import uuid
+import statistics
+import requests
+from urllib.parse import urljoin, quote
+
+# 探测用临时文件的名称前缀（同步时忽略这些文件）
+PROBE_FILE_PREFIX = '.dufs-sync-probe-'
+
+# 延迟和目录列表各测量的次数
+RTT_SAMPLES = 5
+LISTING_SAMPLES = 10
+
+# 吞吐量测量：从1MB开始，每次放大4倍，直到单次传输超过 MIN_TRANSFER_SECONDS 或达到上限
+PROBE_START_SIZE = 1024 * 1024
+PROBE_MAX_SIZE = 64 * 1024 * 1024
+MIN_TRANSFER_SECONDS = 0.5
+
+class _RepeatReader:
+    """重复同一块随机数据，生成指定大小的上传内容（不占用整块内存）"""
+
+    def __init__(self, block, size):
+        self.block = block
+        self.size = size
+        self.sent = 0
+
+    def __len__(self):
+        return self.size
+
+    def read(self, amt=-1):
+        remaining = self.size - self.sent
+        if remaining <= 0:
+            return b''
+        data = self.block[:min(remaining, len(self.block))]
+        self.sent += len(data)
+        return data
+
+class LinkProbe:
+    """测量往返延迟、小请求速率和上传/下载吞吐量
+
+    吞吐量用服务器根目录下的一个临时文件测量，结束后删除；没有写入权限时只测量延迟。
+    recommend() 根据测量结果给出 transfer_workers、transfer_chunk_kb 和 request_timeout。
+    """
+
+    def __init__(self, config, log_callback=None):
+        self.server_url = config.get('server_url', '').rstrip('/') + '/'
+        self.log_callback = log_callback or (lambda message: None)
+        self.session = requests.Session()
+        if config.get('username') and config.get('password'):
+            self.session.auth = (config['username'], config['password'])
+
+    def _timed(self, method, url, **kwargs):
+        """发送请求并返回 (响应, 耗时秒数)"""
+        start = time.perf_counter()
+        response = self.session.request(method, url, timeout=30, **kwargs)
+        response.raise_for_status()
+        return response, time.perf_counter() - start
+
+    def measure_rtt(self):
+        """健康检查端点的往返时间中位数（毫秒）"""
+        url = urljoin(self.server_url, '__dufs__/health')
+        samples = [self._timed('GET', url)[1] for _ in range(RTT_SAMPLES)]
+        return statistics.median(samples) * 1000
+
+    def measure_listing_rate(self):
+        """连续获取根目录列表（?json），返回每秒请求数"""
+        url = urljoin(self.server_url, '?json')
+        start = time.perf_counter()
+        for _ in range(LISTING_SAMPLES):
+            self._timed('GET', url)
+        return LISTING_SAMPLES / (time.perf_counter() - start)
+
+    def measure_throughput(self):
+        """上传并下载临时文件，返回 (上传MB/秒, 下载MB/秒)"""
+        url = urljoin(self.server_url, quote(f"{PROBE_FILE_PREFIX}{uuid.uuid4().hex[:12]}.tmp"))
+        block = os.urandom(PROBE_START_SIZE)
+        size = PROBE_START_SIZE
+        try:
+            while True:
+                _, elapsed = self._timed('PUT', url, data=_RepeatReader(block, size))
+                if elapsed >= MIN_TRANSFER_SECONDS or size >= PROBE_MAX_SIZE:
+                    break
+                size *= 4
+            upload_rate = size / elapsed / (1024 * 1024)
+
+            start = time.perf_counter()
+            received = 0
+            with self.session.get(url, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=PROBE_START_SIZE):
+                    received += len(chunk)
+            download_rate = received / (time.perf_counter() - start) / (1024 * 1024)
+            return upload_rate, download_rate
+        finally:
+            try:
+                self.session.delete(url, timeout=30)
+            except requests.exceptions.RequestException:
+                pass
+
+    def run(self):
+        """执行全部测量，返回结果字典（无法测量的项为None）"""
+        result = {
+            'server_url': self.server_url,
+            'time': time.time(),
+            'rtt_ms': None,
+            'listing_rate': None,
+            'upload_mbps': None,
+            'download_mbps': None
+        }
+        result['rtt_ms'] = round(self.measure_rtt(), 2)
+        self.log_callback(f"往返延迟: {result['rtt_ms']} 毫秒")
+        try:
+            result['listing_rate'] = round(self.measure_listing_rate(), 1)
+            self.log_callback(f"目录列表请求: {result['listing_rate']} 次/秒")
+        except requests.exceptions.RequestException as e:
+            self.log_callback(f"目录列表测量失败: {str(e)}")
+        try:
+            upload_rate, download_rate = self.measure_throughput()
+            result['upload_mbps'] = round(upload_rate, 2)
+            result['download_mbps'] = round(download_rate, 2)
+            self.log_callback(f"上传: {result['upload_mbps']} MB/秒, 下载: {result['download_mbps']} MB/秒")
+        except requests.exceptions.RequestException as e:
+            self.log_callback(f"吞吐量测量失败（可能没有写入权限）: {str(e)}")
+        result['recommended'] = self.recommend(result)
+        return result
+
+    @staticmethod
+    def recommend(result):
+        """根据测量结果推荐传输参数
+
+        - transfer_workers: 小文件每个至少要等几个往返，延迟越高越需要并发来填满链路（1~8）；
+        - transfer_chunk_kb: 每块约为50毫秒的传输量，取2的幂（64KB~8MB）；
+        - request_timeout: 30秒加上延迟的50倍（服务器生成大目录列表也需要时间，不低于默认值，最多300秒）。
+        """
+        rtt_ms = result.get('rtt_ms') or 0
+        workers = max(1, min(8, round(1 + rtt_ms / 10)))
+
+        rates = [r for r in (result.get('upload_mbps'), result.get('download_mbps')) if r]
+        chunk_kb = 1024
+        if rates:
+            target_kb = min(rates) * 1024 * 0.05
+            chunk_kb = 2 ** round(math.log2(max(64, min(8192, target_kb))))
+
+        timeout = min(300, math.ceil(30 + rtt_ms * 50 / 1000))
+        return {'transfer_workers': workers, 'transfer_chunk_kb': chunk_kb, 'request_timeout': timeout}
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务器目录列表缓存 - 负责增量遍历服务器目录树
+"""
+
+import json
+import time
+import threading
+from .config_manager import get_state_path
+
+class ListingCache:
+    """保存每个服务器目录上次的列表内容及其在父目录列表中的修改时间
+
+    目录修改时间未变化时直接复用缓存的子项列表，只重新获取发生变化的分支。
+    注意：多数文件系统中目录的修改时间只反映直接子项的增删，其他客户端在深层目录
+    中的修改要等到定期的完整遍历才能发现；本程序自身的上传和删除会主动使相关目录失效。
+    多个传输线程会同时记录上传结果，所有读写都在 lock 下进行。
+    """
+
+    def __init__(self, server_url, full_walk_interval=600):
+        self.cache_file = get_state_path('listing', server_url.rstrip('/'))
+        self.full_walk_interval = full_walk_interval
+        self.lock = threading.Lock()
+        self.dirs = {}
+        self.last_full_walk = {}
+        self.full_walk = True
+        self.scope = ''
+        self.pruned = ()
+        self.visited = set()
+        self.load()
+
+    def load(self):
+        """从磁盘加载缓存，使重启后的第一次同步也能复用"""
+        try:
+            if self.cache_file.exists():
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.dirs = data.get('dirs', {})
+                self.last_full_walk = data.get('last_full_walk', {})
+                if not isinstance(self.last_full_walk, dict):
+                    self.last_full_walk = {}
+        except Exception:
+            self.dirs = {}
+            self.last_full_walk = {}
+
+    def save(self):
+        """保存缓存到磁盘"""
+        with self.lock:
+            try:
+                tmp_file = self.cache_file.with_suffix('.tmp')
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump({'last_full_walk': self.last_full_walk, 'dirs': self.dirs}, f, ensure_ascii=False)
+                tmp_file.replace(self.cache_file)
+            except Exception:
+                pass
+
+    def begin_walk(self, scope='', pruned=()):
+        """开始一次遍历，返回本次是否为完整遍历
+
+        scope 为本次遍历的子目录（空字符串表示整个服务器），pruned 为其中不遍历的子目录。
+        """
+        with self.lock:
+            elapsed = time.time() - self.last_full_walk.get(scope, 0)
+            # 时钟回拨或到达间隔时都进行完整遍历
+            self.full_walk = self.full_walk_interval <= 0 or elapsed < 0 or elapsed >= self.full_walk_interval
+            self.scope = scope
+            self.pruned = tuple(pruned)
+            self.visited = set()
+            return self.full_walk
+
+    def end_walk(self, complete):
+        """结束遍历：完整成功时清理范围内已不存在的目录，并记录完整遍历时间"""
+        with self.lock:
+            if complete:
+                self.dirs = {path: entry for path, entry in self.dirs.items()
+                             if path in self.visited or not self.in_scope(path)}
+                if self.full_walk:
+                    self.last_full_walk[self.scope] = time.time()
+        self.save()
+
+    def in_scope(self, path):
+        """判断目录是否属于本次遍历的范围"""
+        def under(base):
+            return not base or path == base or path.startswith(base + '/')
+        return under(self.scope) and not any(under(p) for p in self.pruned)
+
+    def get(self, path, mtime):
+        """获取目录的缓存子项列表，目录修改时间不一致或需要完整遍历时返回None"""
+        with self.lock:
+            self.visited.add(path)
+            if self.full_walk or not mtime:
+                return None
+            entry = self.dirs.get(path)
+            if entry and entry.get('mtime') == mtime:
+                return entry['entries']
+            return None
+
+    def previous_entries(self, path):
+        """获取目录上次的子项列表（按名称索引），用于复用未变化文件的hash"""
+        with self.lock:
+            entry = self.dirs.get(path)
+            if not entry:
+                return {}
+            return {item['name']: item for item in entry['entries']}
+
+    @staticmethod
+    def reusable_hash(old, entry):
+        """返回上次列表中可以复用的文件hash（大小和修改时间都未变化）
+
+        不知道服务器修改时间的记录（如刚上传的文件）不能复用：其他客户端随后原地修改成相同大小时
+        无法发现，必须重新获取一次hash，之后才与服务器记录的修改时间对应起来。
+        """
+        if entry.get('path_type') != 'File' or not old or not old.get('hash') or old.get('size') != entry.get('size'):
+            return None
+        if old.get('mtime') is not None and old.get('mtime') == entry.get('mtime'):
+            return old['hash']
+        return None
+
+    def put_file_hash(self, remote_path, size, file_hash):
+        """记录刚上传的文件，并使所在目录的缓存失效
+
+        此时不知道服务器记录的修改时间，hash 不会被 reusable_hash 复用（见其说明）。
+        """
+        with self.lock:
+            parent, _, name = remote_path.rpartition('/')
+            entry = self.dirs.setdefault(parent, {'mtime': None, 'entries': []})
+            entry['mtime'] = None
+            entry['entries'] = [item for item in entry['entries'] if item['name'] != name]
+            entry['entries'].append({'name': name, 'path_type': 'File', 'size': size, 'mtime': None,
+                                     'hash': file_hash})
+
+    def put(self, path, mtime, entries):
+        """记录目录的最新子项列表"""
+        with self.lock:
+            self.visited.add(path)
+            self.dirs[path] = {'mtime': mtime, 'entries': entries}
+
+    def invalidate(self, remote_path):
+        """使路径所在目录及其所有上级目录的缓存失效（保留子项列表以便复用hash）"""
+        with self.lock:
+            parts = remote_path.split('/')[:-1]
+            for i in range(len(parts) + 1):
+                entry = self.dirs.get('/'.join(parts[:i]))
+                if entry:
+                    entry['mtime'] = None
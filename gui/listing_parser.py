@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目录列表解析 - 负责边接收边解析 dufs ?json 响应中的 paths 子项
+"""
+
+import json
+import codecs
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+class _StreamBuffer:
+    """按需从字节块读入文本，只保留尚未解析的部分"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """读入下一块数据（丢弃已解析的部分），已到结尾时返回False"""
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            tail = self.decoder.decode(b'', final=True)
+        else:
+            tail = self.decoder.decode(chunk)
+        self.text = self.text[self.pos:] + tail
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """跳过空白，返回下一个字符（已到结尾时返回空字符串）"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text) or not self.fill():
+                return self.text[self.pos:self.pos + 1]
+
+    def next_char(self, expected):
+        """读取下一个字符，必须是 expected 中的一个"""
+        char = self.peek()
+        if not char or char not in expected:
+            raise ValueError(f"目录列表格式错误: 位置 {self.pos} 处应为 {expected!r}，实际为 {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """解析下一个完整的JSON值
+
+        数据不完整时读入更多再试；值恰好在已读数据的末尾结束时也要再读，
+        因为数字等值可能还没有读完（如 "12" 后面还有 "3"）。
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+def iter_listing_paths(chunks):
+    """逐个产出 ?json 响应中 paths 数组的子项
+
+    chunks 为响应内容的字节块（如 response.iter_content()）。同一时间只保留一个数据块和一个子项，
+    不需要先把整个响应读入内存再解析成一个大对象；没有 paths 时不产出任何子项。
+    """
+    buffer = _StreamBuffer(chunks)
+    buffer.next_char('{')
+    if buffer.peek() == '}':
+        return
+    while True:
+        key = buffer.value()
+        buffer.next_char(':')
+        if key == 'paths':
+            buffer.next_char('[')
+            if buffer.peek() == ']':
+                buffer.pos += 1
+            else:
+                while True:
+                    yield buffer.value()
+                    if buffer.next_char(',]') == ']':
+                        break
+        else:
+            buffer.value()
+        if buffer.next_char(',}') == '}':
+            return
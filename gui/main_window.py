@@ -10,7 +10,26 @@ from tkinter import filedialog, messagebox
 import threading
 import os
 from .sync_engine import SyncEngine
+from .fanout import FanoutSync, get_target_urls
 from .config_manager import ConfigManager
+from .subtree_rules import parse_rule_lines, format_rule_lines
+from .sync_logging import shutdown_file_logging
+from .link_probe import LinkProbe
+from .sync_events import EventQueue, LogMessage, StatsUpdated, TransferProgress, TransferFinished
+
+# 界面读取同步事件的间隔（毫秒）和每次最多处理的事件数
+EVENT_POLL_INTERVAL = 100
+EVENT_POLL_BATCH = 500
+
+# 同步优先级选项
+PRIORITY_LABELS = {'normal': '正常', 'low': '低', 'idle': '空闲'}
+
+def parse_number(text):
+    """解析界面中输入的非负数，无效时返回0"""
+    try:
+        return max(0, float(text))
+    except ValueError:
+        return 0
 
 class MainWindow(ctk.CTk):
     def __init__(self):
@@ -31,15 +50,21 @@ class MainWindow(ctk.CTk):
         # 同步引擎
         self.sync_engine = None
         self.sync_thread = None
+        self.manual_engine = None
         self.is_syncing = False
         self.is_paused = False
         
+        # 同步引擎的事件队列（界面定时读取，引擎线程不会因界面繁忙而等待）
+        self.events = EventQueue()
+        self.target_stats = {}
+        
         # 创建界面
         self.create_widgets()
         self.load_settings()
         
         # 设置窗口关闭协议
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.after(EVENT_POLL_INTERVAL, self.poll_events)
         
     def center_window(self):
         """将窗口居中显示"""
@@ -115,7 +140,13 @@ class MainWindow(ctk.CTk):
         
         ctk.CTkLabel(server_frame, text="服务器地址:", font=ctk.CTkFont(weight="bold")).pack(anchor="w", padx=15, pady=(10, 3))
         self.server_entry = ctk.CTkEntry(server_frame, placeholder_text="http://127.0.0.1:5000")
-        self.server_entry.pack(fill="x", padx=15, pady=(0, 10))
+        self.server_entry.pack(fill="x", padx=15, pady=(0, 3))
+        
+        extra_help = "附加服务器 (可选，每行一个)：本地只扫描一次，同时同步到所有服务器"
+        ctk.CTkLabel(server_frame, text=extra_help,
+                    font=ctk.CTkFont(size=10), text_color=("gray60", "gray40")).pack(anchor="w", padx=15)
+        self.extra_servers_text = ctk.CTkTextbox(server_frame, height=45)
+        self.extra_servers_text.pack(fill="x", padx=15, pady=(3, 10))
         
         # 本地文件夹设置
         folder_frame = ctk.CTkFrame(scrollable_frame, fg_color=("gray85", "gray25"))
@@ -152,6 +183,19 @@ class MainWindow(ctk.CTk):
         self.exclude_text = ctk.CTkTextbox(exclude_frame, height=60)
         self.exclude_text.pack(fill="x", padx=15, pady=(3, 10))
         
+        # 选择性同步设置
+        subtree_frame = ctk.CTkFrame(scrollable_frame, fg_color=("gray85", "gray25"))
+        subtree_frame.pack(fill="x", padx=5, pady=6)
+        
+        ctk.CTkLabel(subtree_frame, text="选择性同步 (可选):", font=ctk.CTkFont(weight="bold")).pack(anchor="w", padx=15, pady=(10, 3))
+        
+        subtree_help = "每行一个子目录及其同步间隔（秒），留空则按同步间隔同步整个文件夹：\n• 项目/进行中 5  • 归档 3600  • 归档/旧资料 0 (不同步)  • / 600 (其余目录)"
+        ctk.CTkLabel(subtree_frame, text=subtree_help, justify="left",
+                    font=ctk.CTkFont(size=10), text_color=("gray60", "gray40")).pack(anchor="w", padx=15)
+        
+        self.subtree_text = ctk.CTkTextbox(subtree_frame, height=60)
+        self.subtree_text.pack(fill="x", padx=15, pady=(3, 10))
+        
         # 认证设置
         auth_frame = ctk.CTkFrame(scrollable_frame, fg_color=("gray85", "gray25"))
         auth_frame.pack(fill="x", padx=5, pady=6)
@@ -184,6 +228,33 @@ class MainWindow(ctk.CTk):
         
         ctk.CTkLabel(interval_control_frame, text="秒").pack(side="left")
         
+        # 资源占用设置
+        resource_frame = ctk.CTkFrame(scrollable_frame, fg_color=("gray85", "gray25"))
+        resource_frame.pack(fill="x", padx=5, pady=6)
+        
+        ctk.CTkLabel(resource_frame, text="资源占用 (可选):", font=ctk.CTkFont(weight="bold")).pack(anchor="w", padx=15, pady=(10, 3))
+        
+        priority_frame = ctk.CTkFrame(resource_frame, fg_color="transparent")
+        priority_frame.pack(fill="x", padx=15, pady=(0, 5))
+        
+        ctk.CTkLabel(priority_frame, text="同步优先级:").pack(side="left", padx=(0, 5))
+        self.priority_var = ctk.StringVar(value="正常")
+        ctk.CTkSegmentedButton(priority_frame, values=list(PRIORITY_LABELS.values()),
+                               variable=self.priority_var).pack(side="left")
+        
+        limit_frame = ctk.CTkFrame(resource_frame, fg_color="transparent")
+        limit_frame.pack(fill="x", padx=15, pady=(0, 10))
+        
+        ctk.CTkLabel(limit_frame, text="hash读取上限:").pack(side="left", padx=(0, 5))
+        self.read_limit_var = ctk.StringVar(value="0")
+        ctk.CTkEntry(limit_frame, textvariable=self.read_limit_var, width=60).pack(side="left", padx=(0, 5))
+        ctk.CTkLabel(limit_frame, text="MB/秒").pack(side="left", padx=(0, 15))
+        
+        ctk.CTkLabel(limit_frame, text="负载超过").pack(side="left", padx=(0, 5))
+        self.load_threshold_var = ctk.StringVar(value="0")
+        ctk.CTkEntry(limit_frame, textvariable=self.load_threshold_var, width=60).pack(side="left", padx=(0, 5))
+        ctk.CTkLabel(limit_frame, text="时暂停扫描 (0为不限制)").pack(side="left")
+        
     def create_sync_rules(self):
         # 创建滚动框架
         scrollable_frame = ctk.CTkScrollableFrame(self.tab_rules, fg_color="transparent")
@@ -280,7 +351,7 @@ class MainWindow(ctk.CTk):
         status_frame.pack(fill="both", expand=True, padx=10, pady=10)
         
         # 状态信息区域
-        info_frame = ctk.CTkFrame(status_frame, fg_color=("gray85", "gray25"), height=80)
+        info_frame = ctk.CTkFrame(status_frame, fg_color=("gray85", "gray25"), height=95)
         info_frame.pack(fill="x", padx=5, pady=(0, 10))
         info_frame.pack_propagate(False)
         
@@ -316,6 +387,15 @@ class MainWindow(ctk.CTk):
             font=ctk.CTkFont(size=14, weight="bold")
         ).pack(side="left")
         
+        # 详细日志：显示逐个文件的扫描和跳过信息（大目录下会明显变慢）
+        self.verbose_log_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            log_header_frame,
+            text="详细日志",
+            variable=self.verbose_log_var,
+            font=ctk.CTkFont(size=11)
+        ).pack(side="left", padx=(15, 0))
+        
         # 清除日志按钮
         clear_log_btn = ctk.CTkButton(
             log_header_frame, 
@@ -361,7 +441,7 @@ class MainWindow(ctk.CTk):
         save_btn.pack(side="left", padx=(0, 10))
         
         # 测试连接按钮 - 紫色系
-        test_btn = ctk.CTkButton(
+        self.test_btn = ctk.CTkButton(
             left_buttons, 
             text="🔗 测试连接", 
             command=self.test_connection, 
@@ -371,7 +451,7 @@ class MainWindow(ctk.CTk):
             hover_color=("#6A1B9A", "#4A148C"),
             font=ctk.CTkFont(size=12)
         )
-        test_btn.pack(side="left", padx=(0, 10))
+        self.test_btn.pack(side="left", padx=(0, 10))
         
         # 手动同步按钮 - 橙色系
         self.manual_sync_btn = ctk.CTkButton(
@@ -438,15 +518,23 @@ class MainWindow(ctk.CTk):
             self.folder_entry.insert(0, folder)
             
     def save_settings(self):
-        config = {
+        # 保留界面上没有对应控件的高级配置项
+        config = dict(self.config or {})
+        config.update({
             'server_url': self.server_entry.get(),
+            'extra_server_urls': [u.strip() for u in self.extra_servers_text.get("1.0", tk.END).split('\n') if u.strip()],
             'local_folder': self.folder_entry.get(),
             'exclude_rules': self.exclude_text.get("1.0", tk.END).strip().split('\n'),
             'sync_interval': int(self.interval_var.get()) if self.interval_var.get().isdigit() else 30,
             'sync_mode': self.sync_mode.get(),
+            'subtree_rules': parse_rule_lines(self.subtree_text.get("1.0", tk.END)),
+            'background_priority': next((k for k, v in PRIORITY_LABELS.items() if v == self.priority_var.get()), 'normal'),
+            'hash_read_limit_mb': parse_number(self.read_limit_var.get()),
+            'pause_load_threshold': parse_number(self.load_threshold_var.get()),
+            'log_level': 'debug' if self.verbose_log_var.get() else 'info',
             'username': self.username_entry.get(),
             'password': self.password_entry.get()
-        }
+        })
         
         self.config_manager.save_config(config)
         self.config = config
@@ -455,14 +543,25 @@ class MainWindow(ctk.CTk):
     def load_settings(self):
         if self.config:
             self.server_entry.insert(0, self.config.get('server_url', ''))
+            extra_server_urls = self.config.get('extra_server_urls', [])
+            if extra_server_urls:
+                self.extra_servers_text.insert("1.0", '\n'.join(extra_server_urls))
             self.folder_entry.insert(0, self.config.get('local_folder', ''))
             
             exclude_rules = self.config.get('exclude_rules', [])
             if exclude_rules and exclude_rules != ['']:
                 self.exclude_text.insert("1.0", '\n'.join(exclude_rules))
                 
+            subtree_rules = self.config.get('subtree_rules', [])
+            if subtree_rules:
+                self.subtree_text.insert("1.0", format_rule_lines(subtree_rules))
+                
             self.interval_var.set(str(self.config.get('sync_interval', 30)))
+            self.priority_var.set(PRIORITY_LABELS.get(self.config.get('background_priority', 'normal'), '正常'))
+            self.read_limit_var.set(str(self.config.get('hash_read_limit_mb', 0)))
+            self.load_threshold_var.set(str(self.config.get('pause_load_threshold', 0)))
             self.sync_mode.set(self.config.get('sync_mode', 'mirror'))
+            self.verbose_log_var.set(self.config.get('log_level', 'info') == 'debug')
             
             self.username_entry.insert(0, self.config.get('username', ''))
             self.password_entry.insert(0, self.config.get('password', ''))
@@ -485,7 +584,7 @@ class MainWindow(ctk.CTk):
         self.save_settings()
         
         # 创建同步引擎
-        self.sync_engine = SyncEngine(self.config, self.log_callback, self.stats_callback)
+        self.sync_engine = self.create_engine()
         
         # 启动同步线程
         self.sync_thread = threading.Thread(target=self.sync_engine.start_sync, daemon=True)
@@ -502,6 +601,13 @@ class MainWindow(ctk.CTk):
         self.status_label.configure(text="🔄 状态: 同步中...")
         self.log_message("同步已启动")
         
+    def create_engine(self):
+        """创建同步引擎，配置了多个服务器时创建多目标同步（日志和统计都通过事件队列接收）"""
+        self.target_stats = {}
+        if len(get_target_urls(self.config)) > 1:
+            return FanoutSync(self.config, event_queue=self.events)
+        return SyncEngine(self.config, event_queue=self.events)
+        
     def stop_sync(self):
         if self.sync_engine:
             self.sync_engine.stop_sync()
@@ -540,16 +646,45 @@ class MainWindow(ctk.CTk):
             self.log_message("同步已继续")
         
     def log_callback(self, message):
-        """同步引擎的日志回调"""
+        """后台线程的日志（转到界面线程显示）"""
         self.after(0, lambda: self.log_message(message))
         
-    def stats_callback(self, stats):
-        """同步引擎的统计回调"""
-        self.after(0, lambda: self.update_stats_display(stats))
+    def poll_events(self):
+        """读取并显示同步引擎的事件"""
+        events = self.events.drain(EVENT_POLL_BATCH)
+        multi_target = len(get_target_urls(self.config or {})) > 1
+        stats_changed = False
+        for event in events:
+            if isinstance(event, LogMessage):
+                if multi_target and event.target:
+                    self.log_message(f"[{FanoutSync._target_name(event.target)}] {event.message}")
+                else:
+                    self.log_message(event.message)
+            elif isinstance(event, StatsUpdated):
+                self.target_stats[event.target] = event.stats
+                stats_changed = True
+            elif isinstance(event, TransferProgress) and self.is_syncing and not self.is_paused and event.total:
+                action = "上传" if event.kind == 'upload' else "下载"
+                self.status_label.configure(
+                    text=f"🔄 状态: 同步中... {action} {event.path} {event.done * 100 // event.total}%")
+            elif isinstance(event, TransferFinished) and self.is_syncing and not self.is_paused:
+                self.status_label.configure(text="🔄 状态: 同步中...")
+        if stats_changed:
+            stats = {key: sum(t.get(key, 0) for t in self.target_stats.values())
+                     for key in ('uploaded', 'downloaded', 'deleted', 'moved')}
+            stats['targets'] = dict(self.target_stats)
+            self.update_stats_display(stats)
+        # 还有积压的事件时尽快再次读取
+        self.after(10 if len(events) >= EVENT_POLL_BATCH else EVENT_POLL_INTERVAL, self.poll_events)
         
     def update_stats_display(self, stats):
         """更新统计显示"""
-        stats_text = f"统计: 上传 {stats['uploaded']} | 下载 {stats['downloaded']} | 删除 {stats['deleted']}"
+        stats_text = f"统计: 上传 {stats['uploaded']} | 下载 {stats['downloaded']} | 删除 {stats['deleted']} | 移动 {stats.get('moved', 0)}"
+        targets = stats.get('targets')
+        if targets and len(targets) > 1:
+            stats_text += "\n" + "  ".join(
+                f"{FanoutSync._target_name(url)}: ↑{t['uploaded']} ↓{t['downloaded']} ✕{t['deleted']}"
+                for url, t in targets.items())
         self.stats_label.configure(text=stats_text)
         
     def clear_log(self):
@@ -580,55 +715,95 @@ class MainWindow(ctk.CTk):
         
         def run_manual_sync():
             try:
-                from .sync_engine import SyncEngine
-                temp_engine = SyncEngine(self.config, self.log_callback, self.stats_callback)
-                temp_engine.sync_files()
+                from .cancellation import SyncCancelled
+                self.manual_engine = self.create_engine()
+                self.manual_engine.sync_files()
                 self.after(0, lambda: self.log_message("手动同步完成"))
+            except SyncCancelled:
+                pass
             except Exception as e:
                 self.after(0, lambda: self.log_message(f"手动同步失败: {str(e)}"))
             finally:
+                self.manual_engine = None
                 self.after(0, lambda: self.manual_sync_btn.configure(state="normal"))
         
         # 在后台线程执行手动同步
         threading.Thread(target=run_manual_sync, daemon=True).start()
         
     def test_connection(self):
-        """测试服务器连接"""
+        """测试服务器连接，连接正常后测量链路并推荐传输参数（在后台线程中进行）"""
         server_url = self.server_entry.get()
         if not server_url:
             messagebox.showerror("错误", "请输入服务器地址")
             return
             
+        probe_config = {
+            'server_url': server_url,
+            'username': self.username_entry.get(),
+            'password': self.password_entry.get()
+        }
+        self.test_btn.configure(state="disabled")
+        self.log_message("正在测试服务器连接...")
+        threading.Thread(target=self.run_connection_test, args=(probe_config,), daemon=True).start()
+        
+    def run_connection_test(self, probe_config):
+        """后台线程：健康检查和链路探测"""
+        import requests
         try:
-            import requests
             session = requests.Session()
             
             # 设置认证
-            username = self.username_entry.get()
-            password = self.password_entry.get()
-            if username and password:
-                session.auth = (username, password)
+            if probe_config['username'] and probe_config['password']:
+                session.auth = (probe_config['username'], probe_config['password'])
                 
             # 测试健康检查端点
-            health_url = f"{server_url.rstrip('/')}/__dufs__/health"
+            health_url = f"{probe_config['server_url'].rstrip('/')}/__dufs__/health"
             response = session.get(health_url, timeout=10)
             
-            if response.status_code == 200:
-                messagebox.showinfo("成功", "服务器连接正常")
-                self.log_message("服务器连接测试成功")
-            else:
-                messagebox.showwarning("警告", f"服务器响应异常: {response.status_code}")
-                self.log_message(f"服务器连接测试失败: {response.status_code}")
+            if response.status_code != 200:
+                status = response.status_code
+                self.after(0, lambda: messagebox.showwarning("警告", f"服务器响应异常: {status}"))
+                self.log_callback(f"服务器连接测试失败: {status}")
+                return
+                
+            self.log_callback("服务器连接测试成功，开始测量链路...")
+            result = LinkProbe(probe_config, self.log_callback).run()
+            self.after(0, lambda: self.show_probe_result(result))
                 
         except requests.exceptions.Timeout:
-            messagebox.showerror("错误", "连接超时，请检查服务器地址")
-            self.log_message("服务器连接超时")
+            self.after(0, lambda: messagebox.showerror("错误", "连接超时，请检查服务器地址"))
+            self.log_callback("服务器连接超时")
         except requests.exceptions.ConnectionError:
-            messagebox.showerror("错误", "无法连接到服务器，请检查地址和网络")
-            self.log_message("服务器连接失败")
+            self.after(0, lambda: messagebox.showerror("错误", "无法连接到服务器，请检查地址和网络"))
+            self.log_callback("服务器连接失败")
         except Exception as e:
-            messagebox.showerror("错误", f"连接测试失败: {str(e)}")
-            self.log_message(f"服务器连接测试异常: {str(e)}")
+            error = str(e)
+            self.after(0, lambda: messagebox.showerror("错误", f"连接测试失败: {error}"))
+            self.log_callback(f"服务器连接测试异常: {error}")
+        finally:
+            self.after(0, lambda: self.test_btn.configure(state="normal"))
+            
+    def show_probe_result(self, result):
+        """显示链路探测结果，询问是否应用推荐的传输参数（结果保存到配置中）"""
+        recommended = result['recommended']
+        lines = [f"往返延迟: {result['rtt_ms']} 毫秒"]
+        if result['listing_rate'] is not None:
+            lines.append(f"目录列表: {result['listing_rate']} 次/秒")
+        if result['upload_mbps'] is not None:
+            lines.append(f"上传: {result['upload_mbps']} MB/秒，下载: {result['download_mbps']} MB/秒")
+        lines.append("")
+        lines.append("推荐设置:")
+        lines.append(f"  并发传输数: {recommended['transfer_workers']}")
+        lines.append(f"  数据块大小: {recommended['transfer_chunk_kb']} KB")
+        lines.append(f"  请求超时: {recommended['request_timeout']} 秒")
+        
+        config = dict(self.config or {})
+        config['link_probe'] = result
+        if messagebox.askyesno("服务器连接正常", "\n".join(lines) + "\n\n是否应用推荐的传输设置？"):
+            config.update(recommended)
+            self.log_message("已应用推荐的传输设置（下次启动同步时生效）")
+        self.config_manager.save_config(config)
+        self.config = config
     
     def log_message(self, message):
         """添加日志消息"""
@@ -640,7 +815,12 @@ class MainWindow(ctk.CTk):
         self.log_text.see(tk.END)
         
     def on_closing(self):
-        """窗口关闭事件"""
+        """窗口关闭事件：停止同步并等待同步线程在检查点退出"""
         if self.is_syncing:
             self.stop_sync()
+        if self.manual_engine:
+            self.manual_engine.stop_sync()
+        if self.sync_thread and self.sync_thread.is_alive():
+            self.sync_thread.join(timeout=3)
+        shutdown_file_logging()
         self.destroy()
\ No newline at end of file
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+移动检测 - 根据文件hash识别重命名和移动操作
+"""
+
+import bisect
+import posixpath
+
+def detect_moves(old_files, new_files):
+    """识别从旧布局到新布局的移动操作
+
+    old_files: 待调整一侧的文件 {路径: {'hash': ..., ...}}（例如本地为准时的服务器）
+    new_files: 目标布局一侧的文件 {路径: {'hash': ..., ...}}（例如本地为准时的本地）
+
+    只在旧布局中存在的文件与只在新布局中存在的文件按hash配对，整个目录被改名时合并为
+    一次目录移动。返回 [{'src': ..., 'dst': ..., 'is_dir': bool, 'files': [(源, 目标), ...]}]，
+    目录移动排在前面。
+    """
+    gone = {path: info for path, info in old_files.items() if path not in new_files}
+    added = {path: info for path, info in new_files.items() if path not in old_files}
+    if not gone or not added:
+        return []
+
+    # 按hash建立消失文件的索引
+    gone_by_hash = {}
+    for path, info in gone.items():
+        if info.get('hash'):
+            gone_by_hash.setdefault(info['hash'], []).append(path)
+
+    # 新文件与消失文件配对，同名文件优先
+    pairs = {}
+    for path in sorted(added):
+        candidates = gone_by_hash.get(added[path].get('hash'))
+        if not candidates:
+            continue
+        name = posixpath.basename(path)
+        src = next((c for c in candidates if posixpath.basename(c) == name), candidates[0])
+        candidates.remove(src)
+        pairs[src] = path
+
+    old_sorted = sorted(old_files)
+    new_dirs = _parent_dirs(new_files)
+    old_dirs = _parent_dirs(old_files)
+
+    moves = []
+    moved_dirs = []
+    for src_dir, dst_dir in _directory_candidates(pairs):
+        if any(src_dir == d or src_dir.startswith(d + '/') for d in moved_dirs):
+            continue
+        # 源目录在新布局中不应再有文件，目标目录在旧布局中不应已存在
+        if src_dir in new_dirs or dst_dir in old_dirs:
+            continue
+        files = _directory_move_files(src_dir, dst_dir, pairs, old_sorted)
+        if files:
+            moves.append({'src': src_dir, 'dst': dst_dir, 'is_dir': True, 'files': files})
+            moved_dirs.append(src_dir)
+
+    for src, dst in sorted(pairs.items()):
+        if not any(src.startswith(d + '/') for d in moved_dirs):
+            moves.append({'src': src, 'dst': dst, 'is_dir': False, 'files': [(src, dst)]})
+    return moves
+
+def _parent_dirs(files):
+    """返回文件路径涉及的所有上级目录"""
+    dirs = set()
+    for path in files:
+        parts = path.split('/')[:-1]
+        for i in range(1, len(parts) + 1):
+            dirs.add('/'.join(parts[:i]))
+    return dirs
+
+def _directory_candidates(pairs):
+    """从配对结果推导可能的目录改名 (源目录, 目标目录)，上层目录在前"""
+    candidates = set()
+    for src, dst in pairs.items():
+        src_parts = src.split('/')
+        dst_parts = dst.split('/')
+        # 去掉相同的末尾部分，剩余的前缀就是可能被改名的目录
+        while len(src_parts) > 1 and len(dst_parts) > 1 and src_parts[-1] == dst_parts[-1]:
+            src_parts.pop()
+            dst_parts.pop()
+            candidates.add(('/'.join(src_parts), '/'.join(dst_parts)))
+    return sorted(candidates, key=lambda c: (c[0].count('/'), c))
+
+def _directory_move_files(src_dir, dst_dir, pairs, old_sorted):
+    """检查目录是否整体改名，是则返回其中所有文件的 (源, 目标) 列表，否则返回None"""
+    if dst_dir.startswith(src_dir + '/') or src_dir.startswith(dst_dir + '/'):
+        return None
+    src_prefix = src_dir + '/'
+    dst_prefix = dst_dir + '/'
+    # 排序后的路径列表中，src_prefix 开头的路径位于 [src_dir + '/', src_dir + '0') 区间内
+    start = bisect.bisect_left(old_sorted, src_prefix)
+    end = bisect.bisect_left(old_sorted, src_dir + '0')
+
+    files = []
+    for path in old_sorted[start:end]:
+        expected = dst_prefix + path[len(src_prefix):]
+        if pairs.get(path) != expected:
+            return None
+        files.append((path, expected))
+    return files or None
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+资源控制 - 负责降低扫描和hash计算对前台程序的影响
+"""
+
+import os
+import sys
+import time
+import platform
+import threading
+
+# psutil 为可选依赖，只在没有 os.getloadavg 的系统（Windows）上用于获取系统负载
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# 检查系统负载的最小间隔（秒）
+LOAD_CHECK_INTERVAL = 5
+
+# Linux ioprio_set 系统调用号
+IOPRIO_SYSCALLS = {'x86_64': 251, 'aarch64': 30, 'i386': 289, 'i686': 289, 'armv7l': 314}
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+# Windows 线程优先级
+THREAD_PRIORITY_BELOW_NORMAL = -1
+THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+
+class ResourceGovernor:
+    """扫描和hash计算的资源控制
+
+    - background_priority: 同步线程的CPU和I/O优先级，normal（不调整）、low 或 idle。
+      只调整同步线程，不影响同一进程中的界面线程。
+    - hash_read_limit_mb: 计算hash时的读取速度上限（MB/秒），0表示不限制。
+    - pause_load_threshold: 系统1分钟平均负载超过该值时暂停扫描和hash计算，
+      降到阈值的80%以下后继续，0表示不检查。
+    """
+
+    def __init__(self, config, token, log_callback):
+        self.token = token
+        self.log_callback = log_callback
+        self.priority = config.get('background_priority', 'normal')
+        self.read_limit = max(0, float(config.get('hash_read_limit_mb', 0))) * 1024 * 1024
+        self.load_threshold = max(0, float(config.get('pause_load_threshold', 0)))
+        self.lock = threading.Lock()
+        self.allowance = self.read_limit
+        self.last_refill = time.monotonic()
+        self.last_load_check = 0
+        self.load_unsupported = False
+        self.applied = threading.local()
+
+    def apply_thread_priority(self):
+        """降低当前线程的CPU和I/O优先级（每个线程只调整一次）"""
+        if self.priority not in ('low', 'idle') or getattr(self.applied, 'done', False):
+            return
+        self.applied.done = True
+        try:
+            if sys.platform == 'win32':
+                self._apply_windows_priority()
+            elif sys.platform.startswith('linux'):
+                self._apply_linux_priority()
+        except Exception as e:
+            self.log_callback(f"调整同步线程优先级失败: {str(e)}")
+
+    def _apply_windows_priority(self):
+        """Windows：后台模式同时降低CPU、I/O和内存优先级"""
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        thread = kernel32.GetCurrentThread()
+        mode = THREAD_MODE_BACKGROUND_BEGIN if self.priority == 'idle' else THREAD_PRIORITY_BELOW_NORMAL
+        kernel32.SetThreadPriority(thread, mode)
+
+    def _apply_linux_priority(self):
+        """Linux：nice值和I/O优先级都可以按线程设置"""
+        tid = threading.get_native_id()
+        os.setpriority(os.PRIO_PROCESS, tid, 19 if self.priority == 'idle' else 10)
+        syscall_nr = IOPRIO_SYSCALLS.get(platform.machine())
+        if syscall_nr is None:
+            return
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if self.priority == 'idle':
+            ioprio = IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+        else:
+            ioprio = (IOPRIO_CLASS_BE << IOPRIO_CLASS_SHIFT) | 7
+        # IOPRIO_WHO_PROCESS = 1，传入线程ID时只影响该线程
+        libc.syscall(syscall_nr, 1, tid, ioprio)
+
+    def throttle(self, nbytes):
+        """按读取速度上限等待（令牌桶，最多积累1秒的额度）"""
+        if self.read_limit <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.read_limit, self.allowance + (now - self.last_refill) * self.read_limit)
+            self.last_refill = now
+            self.allowance -= nbytes
+            delay = -self.allowance / self.read_limit if self.allowance < 0 else 0
+        if delay > 0:
+            self.token.sleep(delay)
+            self.token.check()
+
+    def system_load(self):
+        """返回系统1分钟平均负载，无法获取时返回None"""
+        try:
+            if hasattr(os, 'getloadavg'):
+                return os.getloadavg()[0]
+            if psutil is not None:
+                return psutil.getloadavg()[0]
+        except (OSError, AttributeError):
+            pass
+        return None
+
+    def wait_if_busy(self):
+        """系统繁忙时暂停，直到负载降下来（可被停止打断）"""
+        if self.load_threshold <= 0 or self.load_unsupported:
+            return
+        now = time.monotonic()
+        if now - self.last_load_check < LOAD_CHECK_INTERVAL:
+            return
+        self.last_load_check = now
+
+        load = self.system_load()
+        if load is None:
+            self.load_unsupported = True
+            self.log_callback("无法获取系统负载（Windows上需要安装psutil），不再检查系统繁忙")
+            return
+        if load < self.load_threshold:
+            return
+
+        self.log_callback(f"系统繁忙（负载 {load:.1f}），暂停扫描")
+        while load is not None and load >= self.load_threshold * 0.8:
+            self.token.sleep(LOAD_CHECK_INTERVAL)
+            self.token.check()
+            load = self.system_load()
+        self.last_load_check = time.monotonic()
+        self.log_callback("系统负载已降低，继续扫描")
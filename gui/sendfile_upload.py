@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+sendfile 上传 - 负责用 sendfile 把文件内容从页缓存直接发送到套接字（仅限明文HTTP）
+"""
+
+import os
+import base64
+import socket
+import http.client
+import requests
+from urllib.parse import urlsplit
+
+class SendfileUploader:
+    """不经过用户空间缓冲区的PUT上传
+
+    requests 上传时每个数据块都要从内核复制到Python再复制回内核，高速链路上客户端CPU会成为瓶颈。
+    这里只发送请求头，文件内容由 socket.sendfile（即 os.sendfile）分块直接发送，每块之间检查停止/暂停。
+    认证（Basic）、超时和错误与 requests 会话一致：返回 requests.Response，网络错误抛出
+    requests.exceptions 中对应的异常。HTTPS、使用代理或系统不支持 sendfile 时由调用方改用 requests。
+    """
+
+    def __init__(self, config, chunk_size, timeout):
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.headers = {'User-Agent': requests.utils.default_user_agent()}
+        if config.get('username') and config.get('password'):
+            credentials = f"{config['username']}:{config['password']}".encode('utf-8')
+            self.headers['Authorization'] = 'Basic ' + base64.b64encode(credentials).decode('ascii')
+
+    @staticmethod
+    def available():
+        """当前系统是否支持 sendfile"""
+        return hasattr(os, 'sendfile')
+
+    def supports(self, url):
+        """该地址能否用 sendfile 上传（明文HTTP且不经过代理）"""
+        return (self.available() and urlsplit(url).scheme == 'http'
+                and not requests.utils.get_environ_proxies(url))
+
+    def put(self, url, fileobj, size, token, on_progress=None):
+        """上传整个文件，返回 requests.Response
+
+        token 为同步引擎的 CancelToken，on_progress(已发送字节数) 在每块发送后调用。
+        """
+        parts = urlsplit(url)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=self.timeout)
+        try:
+            conn.putrequest('PUT', target, skip_accept_encoding=True)
+            for name, value in self.headers.items():
+                conn.putheader(name, value)
+            conn.putheader('Content-Length', str(size))
+            conn.endheaders()
+
+            sent = 0
+            while sent < size:
+                token.check()
+                count = conn.sock.sendfile(fileobj, sent, min(self.chunk_size, size - sent))
+                if count == 0:
+                    raise requests.exceptions.ConnectionError(f"文件在上传过程中变短: {fileobj.name}")
+                sent += count
+                if on_progress:
+                    on_progress(sent)
+
+            raw = conn.getresponse()
+            response = requests.models.Response()
+            response.status_code = raw.status
+            response.reason = raw.reason
+            response.url = url
+            response.headers = requests.structures.CaseInsensitiveDict(raw.getheaders())
+            response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+            response._content = raw.read()
+            return response
+        except requests.exceptions.RequestException:
+            raise
+        except socket.timeout as e:
+            raise requests.exceptions.Timeout(e)
+        except (OSError, http.client.HTTPException) as e:
+            raise requests.exceptions.ConnectionError(e)
+        finally:
+            conn.close()
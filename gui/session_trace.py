@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+同步会话录制与回放 - 负责把生产环境中的慢场景变成可重复运行的基准测试
+
+录制：配置 trace_file 后 SyncEngine 把每个HTTP请求（方法、路径、请求头、大小、耗时、
+响应状态和响应头）、每轮同步的范围以及本地扫描结果（路径、大小、修改时间、hash）写入
+gzip压缩的JSON Lines文件。dufs接口（?json、?hash、?q=）的响应内容是回放所必需的，总是记录；
+文件内容不记录，回放时用相同大小的零字节代替。
+
+回放：python -m gui.session_trace replay <trace文件> [--latency 1.0]
+在临时目录中按录制的扫描结果重建本地文件（稀疏文件，大小和修改时间一致），用录制的响应
+代替服务器，逐轮运行同步引擎并输出每轮的耗时和请求数。
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+import requests
+from .config_manager import get_state_path
+
+TRACE_VERSION = 1
+
+# 不写入录制文件的配置项和请求头
+PRIVATE_CONFIG_KEYS = ('password', 'username', 'trace_file')
+PRIVATE_HEADERS = ('authorization', 'cookie', 'set-cookie')
+
+class SessionTrace:
+    """同步会话录制文件（gzip压缩，每行一条JSON记录）
+
+    记录类型：
+    - meta: 录制开始时的配置（不含用户名和密码）
+    - state: 录制开始时的目录列表缓存和同步基线（回放时从相同状态开始）
+    - cycle: 一轮同步开始（同步范围）
+    - http: 一个HTTP请求及其响应
+    - scan: 本轮同步看到的本地文件及扫描耗时
+    """
+
+    def __init__(self, trace_file, config):
+        self.base_url = config.get('server_url', '')
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.file = gzip.open(trace_file, 'wt', encoding='utf-8')
+        safe_config = {k: v for k, v in config.items() if k not in PRIVATE_CONFIG_KEYS}
+        self._write({'t': 'meta', 'version': TRACE_VERSION, 'created': time.time(), 'config': safe_config})
+
+    def offset(self):
+        """距离录制开始的秒数"""
+        return round(time.monotonic() - self.started, 6)
+
+    def _write(self, record):
+        with self.lock:
+            if self.file:
+                self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def relative_url(self, url):
+        """去掉服务器地址，只保留路径和查询参数"""
+        return url[len(self.base_url):] if url.startswith(self.base_url) else url
+
+    def record_state(self, listing_cache, baseline=None):
+        """记录录制开始时的目录列表缓存和同步基线（完整遍历时间保存为距今的秒数）"""
+        now = time.time()
+        self._write({
+            't': 'state',
+            'dirs': listing_cache.dirs,
+            'full_walk_age': {scope: now - ts for scope, ts in listing_cache.last_full_walk.items()},
+            'baseline': baseline.rows() if baseline else []
+        })
+
+    def record_cycle(self, scope, pruned):
+        """记录一轮同步开始"""
+        self._write({'t': 'cycle', 'ts': self.offset(), 'scope': scope, 'pruned': sorted(pruned)})
+
+    def record_http(self, method, url, kwargs, response, start, elapsed, error=None):
+        """记录一个HTTP请求及其响应"""
+        data = kwargs.get('data')
+        headers = {k: v for k, v in (kwargs.get('headers') or {}).items() if k.lower() not in PRIVATE_HEADERS}
+        record = {
+            't': 'http',
+            'ts': start,
+            'elapsed': round(elapsed, 6),
+            'method': method.upper(),
+            'url': self.relative_url(url),
+            'req_headers': headers,
+            'req_size': len(data) if data is not None and hasattr(data, '__len__') else None
+        }
+        if error is not None:
+            record['error'] = error
+        else:
+            record['status'] = response.status_code
+            record['headers'] = {k: v for k, v in response.headers.items() if k.lower() not in PRIVATE_HEADERS}
+            record['size'] = int(response.headers.get('Content-Length', 0) or 0)
+            # dufs接口的响应内容回放时需要（目录列表以流的方式读取时也在这里完整读取）；文件内容不记录
+            if '?' in record['url']:
+                try:
+                    record['body'] = response.content.decode('utf-8')
+                except UnicodeDecodeError:
+                    record['body_b64'] = base64.b64encode(response.content).decode('ascii')
+                record['size'] = len(response.content)
+        self._write(record)
+
+    def record_scan(self, files, elapsed):
+        """记录本轮同步看到的本地文件 [路径, 大小, 修改时间, hash]"""
+        self._write({
+            't': 'scan',
+            'ts': self.offset(),
+            'elapsed': round(elapsed, 6),
+            'files': [[f['path'], f['size'], f['mtime'], f.get('hash')] for f in files]
+        })
+
+    def flush(self):
+        """把已录制的内容写入磁盘（进程中途退出时也能读取到这里）"""
+        with self.lock:
+            if self.file:
+                self.file.flush()
+
+    def close(self):
+        """结束录制"""
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+class RecordingSession(requests.Session):
+    """把所有请求写入录制文件的 requests.Session"""
+
+    def __init__(self, trace):
+        super().__init__()
+        self.trace = trace
+
+    def request(self, method, url, **kwargs):
+        start = self.trace.offset()
+        begin = time.monotonic()
+        try:
+            response = super().request(method, url, **kwargs)
+        except Exception as e:
+            self.trace.record_http(method, url, kwargs, None, start, time.monotonic() - begin, error=str(e))
+            raise
+        self.trace.record_http(method, url, kwargs, response, start, time.monotonic() - begin)
+        return response
+
+def load_trace(trace_file):
+    """读取录制文件，录制中途退出导致文件不完整时返回已读到的记录"""
+    records = []
+    try:
+        with gzip.open(trace_file, 'rt', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+    except (EOFError, OSError):
+        pass
+    return records
+
+class _ZeroStream:
+    """回放下载时代替文件内容的零字节流"""
+
+    def __init__(self, size):
+        self.remaining = size
+
+    def read(self, amt=None):
+        amt = self.remaining if amt is None else min(amt, self.remaining)
+        self.remaining -= amt
+        return b'\0' * amt
+
+    def close(self):
+        self.remaining = 0
+
+class ReplaySession(requests.Session):
+    """按录制内容应答请求的 requests.Session
+
+    相同方法和路径的请求按录制顺序依次应答；没有录制的请求返回404并计入 misses。
+    latency_scale 为1时按录制的耗时等待，为0时不等待。
+    """
+
+    def __init__(self, http_records, latency_scale=0.0):
+        super().__init__()
+        self.latency_scale = latency_scale
+        self.queues = defaultdict(deque)
+        for record in http_records:
+            self.queues[(record['method'], record['url'])].append(record)
+        self.lock = threading.Lock()
+        self.base_url = ''
+        self.requests_served = 0
+        self.misses = 0
+
+    def request(self, method, url, **kwargs):
+        relative = url[len(self.base_url):] if url.startswith(self.base_url) else url
+        with self.lock:
+            queue = self.queues.get((method.upper(), relative))
+            record = queue.popleft() if queue else None
+            if record is None:
+                self.misses += 1
+            else:
+                self.requests_served += 1
+
+        # 读完请求内容（上传时边读边计算hash）
+        data = kwargs.get('data')
+        if data is not None and hasattr(data, 'read'):
+            while data.read(1024 * 1024):
+                pass
+
+        if record is None:
+            return self._build_response(url, 404, {}, b'')
+        if self.latency_scale > 0:
+            time.sleep(record.get('elapsed', 0) * self.latency_scale)
+        if 'error' in record:
+            raise requests.exceptions.ConnectionError(record['error'])
+
+        if 'body' in record:
+            body = record['body'].encode('utf-8')
+        elif 'body_b64' in record:
+            body = base64.b64decode(record['body_b64'])
+        else:
+            body = None
+        response = self._build_response(url, record['status'], record.get('headers', {}), body)
+        if body is None:
+            size = record.get('size', 0) if method.upper() == 'GET' else 0
+            response.raw = _ZeroStream(size)
+            response._content = False
+            response._content_consumed = False
+        return response
+
+    @staticmethod
+    def _build_response(url, status, headers, body):
+        response = requests.models.Response()
+        response.status_code = status
+        response.headers = requests.structures.CaseInsensitiveDict(headers)
+        response.url = url
+        response.reason = ''
+        response.encoding = 'utf-8'
+        if body is not None:
+            response._content = body
+            response._content_consumed = True
+        return response
+
+def apply_scan(local_folder, files, hash_state):
+    """让回放目录与录制时的本地文件一致（稀疏文件），并记录已知的hash"""
+    wanted = {}
+    for path, size, mtime, file_hash in files:
+        wanted[path] = (size, mtime)
+        full_path = os.path.join(local_folder, *path.split('/'))
+        try:
+            stat = os.stat(full_path)
+            current = (stat.st_size, int(stat.st_mtime * 1000))
+        except OSError:
+            current = None
+        if current != (size, mtime):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, 'wb') as f:
+                f.truncate(size)
+            # 设在毫秒中间，避免浮点误差使换算回毫秒时差一
+            ns = mtime * 1000000 + 500000
+            os.utime(full_path, ns=(ns, ns))
+        if file_hash:
+            hash_state.put(path, size, mtime, file_hash)
+
+    # 删除录制时不存在的文件
+    for dir_path, _, names in os.walk(local_folder):
+        for name in names:
+            full_path = os.path.join(dir_path, name)
+            rel_path = os.path.relpath(full_path, local_folder).replace(os.sep, '/')
+            if rel_path not in wanted:
+                os.remove(full_path)
+
+def replay(trace_file, latency_scale=0.0, log_callback=None):
+    """回放录制文件，返回每轮同步的结果 [{'scope', 'recorded', 'replayed', 'requests', 'misses'}]"""
+    records = load_trace(trace_file)
+    if not records or records[0].get('t') != 'meta':
+        raise ValueError(f"不是有效的录制文件: {trace_file}")
+    meta = records[0]
+    state = next((r for r in records if r['t'] == 'state'), None)
+
+    # 按轮次拆分记录
+    cycles = []
+    for record in records:
+        if record['t'] == 'cycle':
+            cycles.append({'cycle': record, 'scan': None, 'end': record['ts']})
+        elif cycles and record['t'] in ('http', 'scan'):
+            cycles[-1]['end'] = max(cycles[-1]['end'], record['ts'] + record.get('elapsed', 0))
+            if record['t'] == 'scan':
+                cycles[-1]['scan'] = record
+
+    local_folder = tempfile.mkdtemp(prefix='dufs_replay_')
+    # 每次回放使用新的服务器地址，状态文件互不影响
+    server_url = f"http://replay-{uuid.uuid4().hex[:12]}.invalid/"
+    config = dict(meta['config'],
+                  server_url=server_url,
+                  local_folder=local_folder,
+                  extra_server_urls=[],
+                  journal_enabled=False,
+                  trace_file='',
+                  # 回放的日志不能写入用户真实的日志文件
+                  log_to_file=False)
+    log = log_callback or (lambda message: None)
+    session = ReplaySession([r for r in records if r['t'] == 'http'], latency_scale)
+    session.base_url = server_url
+
+    known_hashes = {}
+    for entry in cycles:
+        for path, size, mtime, file_hash in (entry['scan'] or {}).get('files', []):
+            if file_hash:
+                known_hashes[(path, size, mtime)] = file_hash
+
+    engine = _replay_engine_class()(config, log, known_hashes)
+    engine.session = session
+    engine.sendfile = None
+    if state:
+        now = time.time()
+        engine.listing_cache.dirs = state['dirs']
+        engine.listing_cache.last_full_walk = {scope: now - age for scope, age in state['full_walk_age'].items()}
+        if engine.baseline:
+            for row in state.get('baseline', []):
+                engine.baseline.put(*row)
+            engine.baseline.commit()
+
+    results = []
+    try:
+        for entry in cycles:
+            cycle = entry['cycle']
+            if entry['scan']:
+                apply_scan(local_folder, entry['scan']['files'], engine.hash_state)
+            rule = None
+            if engine.subtree_rules:
+                rule = {'path': cycle['scope'], 'pruned': cycle['pruned'], 'interval': 1}
+            served, misses = session.requests_served, session.misses
+            begin = time.monotonic()
+            engine.sync_files(rule)
+            results.append({
+                'scope': cycle['scope'],
+                'recorded': entry['end'] - cycle['ts'],
+                'replayed': time.monotonic() - begin,
+                'requests': session.requests_served - served,
+                'misses': session.misses - misses
+            })
+    finally:
+        shutil.rmtree(local_folder, ignore_errors=True)
+        if engine.baseline:
+            engine.baseline.close()
+        for path in (get_state_path('listing', server_url.rstrip('/')),
+                     get_state_path('hashes', local_folder, suffix='.snap'),
+                     get_state_path('baseline', server_url.rstrip('/'), local_folder, suffix='.db')):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+    return results
+
+def _replay_engine_class():
+    """回放用的同步引擎（延迟导入，避免与 sync_engine 循环导入）"""
+    from .sync_engine import SyncEngine
+
+    class ReplayEngine(SyncEngine):
+        """回放目录中的文件内容是零字节，计算出的hash换成录制时的hash，使同步决策与录制时一致"""
+
+        def __init__(self, config, log_callback, known_hashes):
+            super().__init__(config, log_callback)
+            self.known_hashes = known_hashes
+            put_state = self.hash_state.put
+            put_listing = self.listing_cache.put_file_hash
+            self.hash_state.put = lambda path, size, mtime, file_hash: put_state(
+                path, size, mtime, self.known_hashes.get((path, size, mtime), file_hash))
+            self.listing_cache.put_file_hash = lambda remote_path, size, file_hash: put_listing(
+                remote_path, size, self.recorded_hash(remote_path, file_hash))
+
+        def recorded_hash(self, rel_path, file_hash):
+            """按本地文件当前的大小和修改时间查找录制时的hash"""
+            full_path = os.path.join(self.config['local_folder'], *rel_path.split('/'))
+            try:
+                stat = os.stat(full_path)
+            except OSError:
+                return file_hash
+            return self.known_hashes.get((rel_path, stat.st_size, int(stat.st_mtime * 1000)), file_hash)
+
+        def verify_upload(self, remote_path, sent_hash):
+            return super().verify_upload(remote_path, self.recorded_hash(remote_path, sent_hash))
+
+        def get_file_hash(self, file_path):
+            rel_path = os.path.relpath(file_path, self.config['local_folder']).replace(os.sep, '/')
+            return self.recorded_hash(rel_path, None) or super().get_file_hash(file_path)
+
+    return ReplayEngine
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="dufs同步会话录制文件工具")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    replay_parser = subparsers.add_parser('replay', help="回放录制文件并输出每轮耗时")
+    replay_parser.add_argument('trace_file')
+    replay_parser.add_argument('--latency', type=float, default=0.0,
+                               help="按录制耗时的倍数模拟服务器延迟（0为不等待）")
+    replay_parser.add_argument('--verbose', action='store_true', help="输出同步日志")
+    args = parser.parse_args(argv)
+
+    results = replay(args.trace_file, args.latency, print if args.verbose else None)
+    print(f"{'轮次':<6}{'范围':<24}{'录制耗时(秒)':>14}{'回放耗时(秒)':>14}{'请求数':>8}{'未匹配':>8}")
+    for index, result in enumerate(results, 1):
+        print(f"{index:<6}{(result['scope'] or '/'):<24}{result['recorded']:>14.3f}"
+              f"{result['replayed']:>14.3f}{result['requests']:>8}{result['misses']:>8}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列式文件快照 - 负责紧凑地保存文件列表并批量比较本地和服务器的文件
+"""
+
+import os
+import mmap
+import bisect
+import struct
+from array import array
+
+# numpy 为可选依赖：有 numpy 时比较操作向量化执行，否则逐项比较（结果相同）
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# sha256 摘要的字节数，没有hash的文件摘要为全0
+DIGEST_SIZE = 32
+EMPTY_DIGEST = bytes(DIGEST_SIZE)
+
+# 没有修改时间时的占位值
+MISSING_MTIME = -1
+
+# 快照文件格式：文件头（标识、文件数、路径数据长度、标志），之后依次是大小、修改时间、摘要、
+# 路径起始位置（文件数+1项）和UTF-8编码的路径数据
+SNAPSHOT_MAGIC = b'DUFSSNP2'
+HEADER = struct.Struct('<8sQQQ')
+
+# 标志位：路径按升序保存，可以用 find() 二分查找
+FLAG_SORTED = 1
+
+class PathTable:
+    """路径到整数编号的映射
+
+    一次比较中的所有快照共用同一个表，相同路径的编号相同，比较时只需比较整数。
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.paths = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    def intern(self, path):
+        """返回路径的编号，第一次出现时分配新编号"""
+        path_id = self.ids.get(path)
+        if path_id is None:
+            path_id = len(self.paths)
+            self.ids[path] = path_id
+            self.paths.append(path)
+        return path_id
+
+def _to_digest(file_hash):
+    """十六进制hash转为摘要字节；没有hash或格式不正确（如旧版dufs的 ?hash 返回文件内容）时为全0，即视为未知"""
+    if not isinstance(file_hash, str) or len(file_hash) != DIGEST_SIZE * 2:
+        return EMPTY_DIGEST
+    try:
+        digest = bytes.fromhex(file_hash)
+    except ValueError:
+        return EMPTY_DIGEST
+    # fromhex 允许空白，解码后长度也要正确
+    return digest if len(digest) == DIGEST_SIZE else EMPTY_DIGEST
+
+def _int_column(values):
+    """整数列：有 numpy 时为 int64 数组（与 array 共用内存），否则为 array('q')"""
+    return np.frombuffer(values, dtype=np.int64) if np is not None else values
+
+def _digest_column(data):
+    """摘要列：有 numpy 时为 S32 数组，否则为原始字节"""
+    return np.frombuffer(data, dtype=f'S{DIGEST_SIZE}') if np is not None else data
+
+class FileSnapshot:
+    """列式文件快照
+
+    每个文件只占用路径编号、大小、修改时间（各8字节）和32字节摘要，路径字符串由 PathTable 统一保存。
+    save() 写入的文件可以用 load() 通过内存映射直接使用，不需要逐项解析；不传 table 时路径也不解码，
+    path()/find() 按需从映射的路径数据中读取。
+    """
+
+    def __init__(self, table, ids, sizes, mtimes, digests, mapping=None,
+                 path_offsets=None, path_data=None, sorted_paths=False):
+        self.table = table
+        self.ids = ids
+        self.sizes = sizes
+        self.mtimes = mtimes
+        self.digests = digests
+        self.mapping = mapping
+        self.path_offsets = path_offsets
+        self.path_data = path_data
+        self.sorted_paths = sorted_paths
+
+    def __len__(self):
+        return len(self.sizes)
+
+    @classmethod
+    def build(cls, table, rows):
+        """由 (路径, 大小, 修改时间, 十六进制hash或None) 序列创建快照（无效的hash按未知处理）"""
+        ids, sizes, mtimes = array('q'), array('q'), array('q')
+        digests = bytearray()
+        for path, size, mtime, file_hash in rows:
+            ids.append(table.intern(path))
+            sizes.append(size or 0)
+            mtimes.append(MISSING_MTIME if mtime is None else int(mtime))
+            digests += _to_digest(file_hash)
+        return cls(table, _int_column(ids), _int_column(sizes), _int_column(mtimes), _digest_column(bytes(digests)))
+
+    @classmethod
+    def from_local_files(cls, table, local_files):
+        """由本地文件列表创建快照"""
+        return cls.build(table, ((f['path'], f['size'], f['mtime'], f.get('hash')) for f in local_files))
+
+    @classmethod
+    def from_server_files(cls, table, server_files):
+        """由服务器文件字典 {路径: 文件信息} 创建快照"""
+        return cls.build(table, ((path, info.get('size', 0), info.get('mtime'), info.get('hash'))
+                                 for path, info in server_files.items()))
+
+    def with_mtimes(self, mtimes):
+        """返回修改时间列替换为 mtimes 的快照（其余列共用）"""
+        column = array('q', (MISSING_MTIME if mtime is None else int(mtime) for mtime in mtimes))
+        return FileSnapshot(self.table, self.ids, self.sizes, _int_column(column), self.digests)
+
+    def path(self, index):
+        if self.ids is None:
+            start, end = int(self.path_offsets[index]), int(self.path_offsets[index + 1])
+            return bytes(self.path_data[start:end]).decode('utf-8')
+        return self.table.paths[self.ids[index]]
+
+    def find(self, path):
+        """返回路径在快照中的下标，不存在时返回-1（路径已排序时二分查找）"""
+        if self.sorted_paths:
+            index = bisect.bisect_left(_PathView(self), path)
+            return index if index < len(self) and self.path(index) == path else -1
+        for index in range(len(self)):
+            if self.path(index) == path:
+                return index
+        return -1
+
+    def digest(self, index):
+        """第 index 个文件的十六进制hash，没有时返回None"""
+        if np is not None:
+            raw = self.digests[index]
+        else:
+            raw = self.digests[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE]
+        raw = bytes(raw).ljust(DIGEST_SIZE, b'\0')
+        return raw.hex() if raw != EMPTY_DIGEST else None
+
+    def mtime(self, index):
+        mtime = int(self.mtimes[index])
+        return None if mtime == MISSING_MTIME else mtime
+
+    def rows(self):
+        """逐个产出 (路径, 大小, 修改时间, hash)"""
+        for index in range(len(self)):
+            yield self.path(index), int(self.sizes[index]), self.mtime(index), self.digest(index)
+
+    def save(self, file_path):
+        """写入快照文件（先写临时文件再替换）"""
+        tmp_path = f"{file_path}.tmp"
+        write_snapshot(tmp_path, self.rows())
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path, table=None, use_mmap=True):
+        """读取快照文件
+
+        use_mmap 为True时各列直接引用内存映射的文件内容（用完后调用 close()）；
+        需要随后替换该文件时（Windows 不能替换已映射的文件）传入False，读入内存后立即关闭文件，
+        或在替换前先调用 close()。
+        传入 table 时所有路径编入该表（用于 diff_snapshots 等比较）；否则不解码路径，按需读取。
+        """
+        with open(file_path, 'rb') as f:
+            if use_mmap:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = f.read()
+        magic, count, paths_length, flags = HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC:
+            if use_mmap:
+                data.close()
+            raise ValueError(f"不是有效的快照文件: {file_path}")
+
+        view = memoryview(data)
+        offset = HEADER.size
+
+        def int_column(length):
+            nonlocal offset
+            chunk = view[offset:offset + length * 8]
+            offset += length * 8
+            return np.frombuffer(chunk, dtype=np.int64) if np is not None else chunk.cast('q')
+
+        sizes, mtimes = int_column(count), int_column(count)
+        digests = view[offset:offset + count * DIGEST_SIZE]
+        digests = np.frombuffer(digests, dtype=f'S{DIGEST_SIZE}') if np is not None else digests
+        offset += count * DIGEST_SIZE
+        path_offsets = int_column(count + 1)
+        path_data = view[offset:offset + paths_length]
+
+        snapshot = cls(table, None, sizes, mtimes, digests, data if use_mmap else None,
+                       path_offsets, path_data, bool(flags & FLAG_SORTED))
+        if table is not None:
+            snapshot.ids = _int_column(array('q', (table.intern(snapshot.path(index)) for index in range(count))))
+        return snapshot
+
+    def close(self):
+        """释放内存映射"""
+        if self.mapping is not None:
+            self.ids = self.sizes = self.mtimes = self.digests = None
+            self.path_offsets = self.path_data = None
+            self.mapping.close()
+            self.mapping = None
+
+class _PathView:
+    """把快照的路径列包装成序列，供 bisect 使用"""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def __getitem__(self, index):
+        return self.snapshot.path(index)
+
+def write_snapshot(file_path, rows):
+    """把 (路径, 大小, 修改时间, hash) 序列写成快照文件
+
+    rows 可以是生成器，按顺序写入；路径恰好按升序排列时标记为已排序，读取后可以二分查找。
+    """
+    sizes, mtimes, offsets = array('q'), array('q'), array('q', [0])
+    digests, paths = bytearray(), bytearray()
+    sorted_paths, previous = True, None
+    for path, size, mtime, file_hash in rows:
+        if previous is not None and path <= previous:
+            sorted_paths = False
+        previous = path
+        sizes.append(size or 0)
+        mtimes.append(MISSING_MTIME if mtime is None else int(mtime))
+        digests += _to_digest(file_hash)
+        paths += path.encode('utf-8')
+        offsets.append(len(paths))
+
+    with open(file_path, 'wb') as f:
+        f.write(HEADER.pack(SNAPSHOT_MAGIC, len(sizes), len(paths), FLAG_SORTED if sorted_paths else 0))
+        for column in (sizes, mtimes):
+            f.write(column.tobytes())
+        f.write(digests)
+        f.write(offsets.tobytes())
+        f.write(paths)
+
+class SnapshotDiff:
+    """两个快照的比较结果
+
+    same_local/same_server: 两边都存在且hash相同的文件在各自快照中的下标（一一对应）；
+    other_ids: 其余路径（只在一边、hash不同或未知）的编号。
+    """
+
+    def __init__(self, same_local, same_server, other_ids):
+        self.same_local = same_local
+        self.same_server = same_server
+        self.other_ids = other_ids
+
+    def matches_baseline(self, local, server, base_local, base_server):
+        """内容相同的每个文件的大小、hash和两边的修改时间是否都与基线一致
+
+        base_local/base_server 为基线的本地一侧和服务器一侧快照（路径顺序相同，只有修改时间列不同）。
+        """
+        if np is not None:
+            base_index = lookup(base_local, local.ids[self.same_local])
+            return (rows_equal(local, self.same_local, base_local, base_index)
+                    & rows_equal(server, self.same_server, base_server, base_index))
+        base_index = lookup(base_local, [local.ids[index] for index in self.same_local])
+        return [a and b for a, b in zip(rows_equal(local, self.same_local, base_local, base_index),
+                                        rows_equal(server, self.same_server, base_server, base_index))]
+
+def diff_snapshots(local, server):
+    """比较本地和服务器快照，找出内容相同的文件（两个快照必须共用同一个 PathTable）"""
+    if np is not None:
+        _, local_index, server_index = np.intersect1d(local.ids, server.ids, assume_unique=True, return_indices=True)
+        local_digests = local.digests[local_index]
+        same = (local_digests == server.digests[server_index]) & (local_digests != b'')
+        same_local, same_server = local_index[same], server_index[same]
+        all_ids = np.union1d(local.ids, server.ids)
+        other_ids = np.setdiff1d(all_ids, local.ids[same_local], assume_unique=True)
+        return SnapshotDiff(same_local, same_server, other_ids)
+
+    server_positions = {path_id: index for index, path_id in enumerate(server.ids)}
+    same_local, same_server, other_ids = [], [], []
+    matched = set()
+    for local_index, path_id in enumerate(local.ids):
+        server_index = server_positions.get(path_id)
+        if server_index is not None:
+            matched.add(path_id)
+            digest = local.digest(local_index)
+            if digest and digest == server.digest(server_index):
+                same_local.append(local_index)
+                same_server.append(server_index)
+                continue
+        other_ids.append(path_id)
+    other_ids.extend(path_id for path_id in server.ids if path_id not in matched)
+    return SnapshotDiff(same_local, same_server, other_ids)
+
+def lookup(snapshot, ids):
+    """返回每个路径编号在快照中的下标，不存在时为-1"""
+    if np is not None:
+        positions = np.full(len(snapshot.table), -1, dtype=np.int64)
+        positions[snapshot.ids] = np.arange(len(snapshot), dtype=np.int64)
+        return positions[np.asarray(ids, dtype=np.int64)]
+    positions = {path_id: index for index, path_id in enumerate(snapshot.ids)}
+    return [positions.get(path_id, -1) for path_id in ids]
+
+def rows_equal(a, a_index, b, b_index):
+    """逐项比较 a[a_index] 与 b[b_index] 的大小、修改时间和hash是否都相同（b_index 为-1时不相同）"""
+    if np is not None:
+        a_index = np.asarray(a_index, dtype=np.int64)
+        b_index = np.asarray(b_index, dtype=np.int64)
+        if len(b) == 0:
+            return np.zeros(len(a_index), dtype=bool)
+        found = b_index >= 0
+        b_index = np.where(found, b_index, 0)
+        return (found & (a.sizes[a_index] == b.sizes[b_index]) & (a.mtimes[a_index] == b.mtimes[b_index])
+                & (a.digests[a_index] == b.digests[b_index]))
+    return [j >= 0 and a.sizes[i] == b.sizes[j] and a.mtimes[i] == b.mtimes[j] and a.digest(i) == b.digest(j)
+            for i, j in zip(a_index, b_index)]
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+选择性同步规则 - 负责解析子目录及其同步间隔
+"""
+
+def normalize_subtree(path):
+    """规范化子目录路径：使用'/'分隔，去掉首尾的'/'，根目录为空字符串"""
+    path = path.strip().replace('\\', '/').strip('/')
+    return '' if path == '.' else path
+
+def parse_subtree_rules(config):
+    """解析配置中的选择性同步规则
+
+    返回 [{'path': 子目录, 'interval': 间隔秒数, 'pruned': [由更具体规则负责的下级子目录]}]。
+    间隔为0表示从不同步；每个子目录只由最具体的规则负责，上级规则遍历时跳过它。
+    """
+    rules = {}
+    for rule in config.get('subtree_rules', []):
+        try:
+            path = normalize_subtree(rule.get('path', ''))
+            interval = rule.get('interval')
+            if interval is None:
+                interval = config.get('sync_interval', 30)
+            interval = max(0, int(interval))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        rules[path] = interval
+
+    result = []
+    for path in sorted(rules):
+        nested = [p for p in rules if p != path and (not path or p.startswith(path + '/'))]
+        # 只保留最上层的下级规则
+        pruned = [p for p in nested if not any(q != p and p.startswith(q + '/') for q in nested)]
+        result.append({'path': path, 'interval': rules[path], 'pruned': sorted(pruned)})
+    return result
+
+def parse_rule_lines(text):
+    """把界面中的文本（每行“子目录 间隔秒数”）解析为规则列表"""
+    rules = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        parts = line.rsplit(None, 1)
+        if len(parts) == 2 and parts[1].isdigit():
+            rules.append({'path': normalize_subtree(parts[0]), 'interval': int(parts[1])})
+        else:
+            rules.append({'path': normalize_subtree(line), 'interval': None})
+    return [r for r in rules if r['interval'] is not None or r['path']]
+
+def format_rule_lines(rules):
+    """把规则列表格式化为界面中显示的文本"""
+    lines = []
+    for rule in rules:
+        path = rule.get('path') or '/'
+        interval = rule.get('interval')
+        lines.append(path if interval is None else f"{path} {interval}")
+    return '\n'.join(lines)
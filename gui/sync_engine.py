@@ -10,25 +10,157 @@ import requests
 import hashlib
 import json
 import threading
+import shutil
+import uuid
+import sys
+import logging
 from pathlib import Path
 import fnmatch
 from urllib.parse import urljoin, quote
+from .listing_cache import ListingCache
+from .transfer_scheduler import TransferScheduler
+from .move_detector import detect_moves
+from .subtree_rules import parse_subtree_rules
+from .cancellation import CancelToken, CancellableReader, SyncCancelled
+from .sync_journal import SyncJournal, JOURNAL_KINDS
+from .hash_state import HashState
+from .resource_governor import ResourceGovernor
+from .session_trace import SessionTrace, RecordingSession
+from .baseline_store import BaselineStore
+from .snapshot import PathTable, FileSnapshot, diff_snapshots
+from .sync_logging import SyncLogger, configure_file_logging
+from .link_probe import PROBE_FILE_PREFIX
+from .sendfile_upload import SendfileUploader
+from .listing_parser import iter_listing_paths
+from .sync_events import (ScanProgress, PlanReady, TransferStarted, TransferProgress, TransferFinished,
+                          StatsUpdated, SyncError, CycleSummary)
+
+# Linux的reflink复制（写时复制克隆）
+FICLONE = 0x40049409
+
+# 计算hash、上传和下载时每次读写的数据块大小（默认值，可由 transfer_chunk_kb 配置）
+CHUNK_SIZE = 1024 * 1024
+
+# 会覆盖或删除服务器文件的操作（依据缓存的目录列表时先确认服务器的最新状态）
+SERVER_OVERWRITE_KINDS = ('upload', 'conflict', 'delete_server')
+
+# 解析目录列表时每次读取的数据块大小
+LISTING_CHUNK_SIZE = 64 * 1024
+
+# 每发现多少个文件报告一次扫描进度
+SCAN_PROGRESS_INTERVAL = 500
+
+# 探测搜索接口用的查询（不会匹配任何文件）
+SEARCH_PROBE_QUERY = 'dufs-sync-probe-5c1e0a'
+
+def _raise(error):
+    """os.walk 的错误回调：遇到无法读取的目录时中止遍历"""
+    raise error
 
 class SyncEngine:
-    def __init__(self, config, log_callback, stats_callback=None):
+    def __init__(self, config, log_callback=None, stats_callback=None, local_snapshot=None, event_queue=None):
         self.config = config
-        self.log_callback = log_callback
+        # 结构化事件（见 sync_events），event_queue 为空时不产生事件
+        self.events = event_queue
+        # 分级日志：界面只接收 log_level 以上的消息，日志文件由后台线程写入
+        configure_file_logging(config)
+        self.logger = SyncLogger(config, log_callback, config.get('server_url', ''), event_queue)
+        self.log_callback = self.logger.info
         self.stats_callback = stats_callback
         self.running = False
         self.paused = False
-        self.session = requests.Session()
+        self.token = CancelToken()
+        
+        # 传输参数（可由测试连接时的链路探测推荐，见 link_probe）
+        self.chunk_size = max(64, int(config.get('transfer_chunk_kb', CHUNK_SIZE // 1024))) * 1024
+        self.timeout = config.get('request_timeout', 30)
+        
+        # 录制模式：记录所有请求和本地扫描结果，用于回放（见 session_trace）
+        self.trace = None
+        self._traced_scan = None
+        if config.get('trace_file'):
+            self.trace = SessionTrace(config['trace_file'], config)
+            self.session = RecordingSession(self.trace)
+        else:
+            self.session = requests.Session()
+        
+        # 扫描和hash计算的优先级、读取限速和系统繁忙时暂停
+        self.governor = ResourceGovernor(config, self.token, self.log_callback)
+        
+        # 大文件用 sendfile 上传（录制时所有请求都要经过录制会话，不使用）
+        self.sendfile = None
+        if config.get('upload_transport', 'requests') == 'sendfile' and not self.trace:
+            if SendfileUploader.available():
+                self.sendfile = SendfileUploader(config, self.chunk_size, self.timeout)
+            else:
+                self.logger.warning("当前系统不支持 sendfile，使用普通上传")
+        
+        # 服务器目录列表缓存（增量遍历）
+        self.listing_cache = ListingCache(config.get('server_url', ''), config.get('full_walk_interval', 600))
+        
+        # 上次成功同步时的文件状态（镜像模式据此判断哪一边修改或删除了文件）
+        self.baseline = None
+        if config.get('sync_mode', 'mirror') == 'mirror' and config.get('use_baseline', True):
+            self.baseline = BaselineStore(config.get('server_url', ''), config.get('local_folder', ''))
+        if self.trace:
+            self.trace.record_state(self.listing_cache, self.baseline)
+        
+        # 已知存在的服务器目录（由目录列表填充，避免重复MKCOL；传输线程并发读写，需持有 remote_dirs_lock）
+        self.remote_dirs = {''}
+        self.remote_dirs_lock = threading.Lock()
+        # 含有被排除文件的服务器目录（这些目录不能整体删除）
+        self.server_hidden_dirs = set()
+        
+        # 服务器内容索引 hash -> 路径（相同内容的上传改为服务器端COPY）
+        self.server_hash_index = {}
+        self.uploading_hashes = {}
+        self.dedup_lock = threading.Lock()
+        
+        # 本地内容索引 hash -> (完整路径, 大小, 修改时间)，下载时优先复用本地已有的相同内容
+        self.local_hash_index = {}
+        
+        # 多服务器同步时共享的本地扫描结果（见 fanout.LocalSnapshot）
+        self.local_snapshot = local_snapshot
+        self.snapshot_versions = {}
+        # 本引擎最近一次写入或删除本地文件的时间：晚于共享扫描的开始时间时，该扫描已经过时
+        self.last_local_write = 0
+        
+        # 本地文件已知的hash（多服务器同步时共享）
+        if local_snapshot is not None:
+            self.hash_state = local_snapshot.hash_state
+        else:
+            self.hash_state = HashState(config.get('local_folder', ''))
+        
+        # 服务器上所有文件的大小（本地文件大小与其都不同时不必计算hash）
+        self.server_sizes = set()
+        
+        # 选择性同步规则（为空时按 sync_interval 同步整个文件夹）
+        self.subtree_rules = parse_subtree_rules(config)
+        self.scope = ''
+        self.pruned = frozenset()
+        self._walk_complete = True
+        self._walk_searched = False
+        self._ordered_walk = True
+        self._fresh_listings = {}
+        self._local_complete = True
+        
+        # 搜索接口支持情况（None 表示尚未探测）及本次遍历的搜索结果
+        self.search_supported = None
+        self._search_groups = None
+        
+        # 同步日志（中断后继续未完成的计划）
+        self.journal = None
+        if config.get('journal_enabled', True):
+            self.journal = SyncJournal(config.get('server_url', ''), config.get('local_folder', ''))
         
         # 统计信息
         self.stats = {
             'uploaded': 0,
             'downloaded': 0,
-            'deleted': 0
+            'deleted': 0,
+            'moved': 0
         }
+        self.stats_lock = threading.Lock()
         
         # 设置认证（如果需要）
         if config.get('username') and config.get('password'):
@@ -37,39 +169,235 @@ class SyncEngine:
     def start_sync(self):
         """启动同步"""
         self.running = True
+        self.governor.apply_thread_priority()
         self.log_callback("开始文件同步...")
+        next_due = {}
+        
+        # 先继续上次中断的计划，之后再进行完整同步
+        try:
+            self.resume_journal()
+        except SyncCancelled:
+            self.log_callback("同步线程已退出")
+            self.close_trace()
+            return
+        except Exception as e:
+            self.logger.warning(f"继续上次同步计划失败: {str(e)}")
         
         while self.running:
             try:
-                if not self.paused:
+                # 暂停时在这里等待继续
+                self.token.check()
+                if self.subtree_rules:
+                    self.sync_due_subtrees(next_due)
+                else:
                     self.sync_files()
-                time.sleep(self.config.get('sync_interval', 30))
+                self.token.sleep(self.next_sleep(next_due))
+            except SyncCancelled:
+                break
             except Exception as e:
-                self.log_callback(f"同步出错: {str(e)}")
-                time.sleep(5)  # 出错后短暂等待
+                self.logger.error(f"同步出错: {str(e)}")
+                self.token.sleep(5)  # 出错后短暂等待
+                
+        self.log_callback("同步线程已退出")
+        self.close_trace()
+        
+    def close_trace(self):
+        """结束录制"""
+        if self.trace:
+            self.trace.close()
+                
+    def resume_journal(self):
+        """继续执行上次中断的同步计划（剩余操作先做快速校验）"""
+        if not self.journal:
+            return
+        pending = self.journal.load_pending()
+        if not pending:
+            return
+            
+        self.log_callback(f"发现上次未完成的同步计划，剩余 {len(pending)} 个操作，校验后继续执行")
+        sync_actions = {kind: [] for kind in JOURNAL_KINDS}
+        self._fresh_listings = {}
+        for entry in pending:
+            self.token.check()
+            try:
+                item = self.revalidate_journal_item(entry)
+            except SyncCancelled:
+                raise
+            except Exception as e:
+                self.logger.warning(f"校验未完成的操作失败 {entry['path']}: {str(e)}")
+                item = None
+            if item:
+                sync_actions[entry['kind']].append(item)
+                
+        # 旧日志作废，校验通过的操作在执行时重新记录
+        self.journal.record_end()
+        valid_count = sum(len(items) for items in sync_actions.values())
+        self.log_callback(f"校验通过 {valid_count} 个操作，其余将在完整同步时重新计划")
+        if valid_count:
+            self.execute_sync_actions(sync_actions)
+        self.journal.record_end()
+        
+    def revalidate_journal_item(self, entry):
+        """检查计划中的操作是否仍然有效，有效时返回可执行的操作，否则返回None
+
+        本地文件必须仍是计划时的状态；服务器一侧重新获取所在目录的列表，必须仍是计划时的状态
+        （计划下载、上传或覆盖的文件未被修改，计划删除的文件未被重新创建），否则留到完整同步时重新计划。
+        合并为整个目录的删除（带 files）比较目录中的文件数。
+        """
+        kind = entry['kind']
+        files = entry.get('files')
+        local_path = Path(self.config['local_folder']) / entry['path']
+        try:
+            stat = local_path.stat()
+            local_now = {'size': stat.st_size, 'mtime': int(stat.st_mtime * 1000)}
+        except OSError:
+            local_now = None
+            
+        # 本地文件必须仍是计划时的状态
+        planned_local = entry.get('local')
+        if kind == 'delete_server':
+            if local_now is not None:
+                return None
+        elif files is not None:
+            if self.count_local_files(local_path) != files:
+                return None
+        elif (planned_local is None) != (local_now is None):
+            return None
+        elif planned_local and (planned_local['size'] != local_now['size']
+                                or planned_local['mtime'] != local_now['mtime']):
+            return None
+            
+        # 服务器文件也必须仍是计划时的状态
+        server_now = self.fresh_server_entry(entry['path'])
+        if kind == 'delete_local':
+            if server_now is not None:
+                return None
+        elif files is not None:
+            if (server_now is None or server_now.get('path_type') != 'Dir'
+                    or self.count_server_files(entry['path']) != files):
+                return None
+        elif not self.server_state_unchanged(entry['path'], entry.get('server'), server_now):
+            return None
+                
+        local_file = None
+        if planned_local:
+            local_file = dict(planned_local, path=entry['path'], full_path=str(local_path))
+        item = {
+            'path': entry['path'],
+            'action': {'type': kind, 'reason': '继续上次未完成的计划'},
+            'local': local_file,
+            'server': entry.get('server')
+        }
+        if files is not None:
+            item['files'] = files
+        return item
+        
+    def server_state_unchanged(self, remote_path, planned, server_now):
+        """服务器文件是否仍是计划时的状态（planned 为计划时的状态，None表示当时不存在）"""
+        if planned is None:
+            return server_now is None
+        if server_now is None or server_now.get('path_type') != 'File' or server_now.get('size') != planned.get('size'):
+            return False
+        if planned.get('mtime') is not None:
+            return server_now.get('mtime') == planned['mtime']
+        # 计划时不知道修改时间，只能比较hash
+        if not server_now.get('hash'):
+            server_now['hash'] = self.get_server_file_hash(remote_path)
+        return bool(planned.get('hash')) and server_now['hash'] == planned['hash']
+        
+    def fresh_server_entry(self, remote_path):
+        """重新获取所在目录的列表，返回该子项的最新信息，不存在时返回None
+
+        每个目录每轮最多获取一次，结果同时写入目录缓存；获取失败时抛出异常。
+        """
+        parent, _, name = remote_path.rpartition('/')
+        entries = self._fresh_listings.get(parent)
+        if entries is None:
+            try:
+                entries = {entry['name']: entry for entry in self._fetch_server_listing(parent)}
+                self.listing_cache.put(parent, None, list(entries.values()))
+            except requests.exceptions.HTTPError as e:
+                if e.response is None or e.response.status_code != 404:
+                    raise
+                entries = {}
+            self._fresh_listings[parent] = entries
+        return entries.get(name)
+        
+    def count_server_files(self, remote_dir):
+        """统计服务器目录中的文件数"""
+        count = 0
+        for entry in self._fetch_server_listing(remote_dir):
+            if entry.get('path_type') == 'File':
+                count += 1
+            elif entry.get('path_type') == 'Dir':
+                count += self.count_server_files(f"{remote_dir}/{entry['name']}")
+        return count
+        
+    def sync_due_subtrees(self, next_due):
+        """同步已到期的子目录，next_due 记录每个子目录下次同步的时间"""
+        for rule in self.subtree_rules:
+            if rule['interval'] <= 0 or not self.running:
+                continue
+            if time.time() >= next_due.get(rule['path'], 0):
+                self.sync_files(rule)
+                next_due[rule['path']] = time.time() + rule['interval']
+                
+    def next_sleep(self, next_due):
+        """计算距离下一次同步的等待时间"""
+        interval = self.config.get('sync_interval', 30)
+        pending = [next_due.get(rule['path'], 0) for rule in self.subtree_rules if rule['interval'] > 0]
+        if not pending:
+            return interval
+        return max(0.5, min(pending) - time.time())
                 
     def stop_sync(self):
-        """停止同步"""
+        """停止同步（正在进行的扫描和传输会在下一个检查点中止）"""
         self.running = False
         self.paused = False
+        self.token.cancel()
         
     def pause_sync(self):
-        """暂停同步"""
+        """暂停同步（正在进行的扫描和传输会在下一个检查点等待）"""
         self.paused = True
+        self.token.pause()
         
     def resume_sync(self):
-        """继续同步"""
+        """继续同步，接着执行暂停前的计划"""
         self.paused = False
+        self.token.resume()
         
-    def sync_files(self):
-        """执行文件同步"""
+    def sync_files(self, rule=None):
+        """执行文件同步
+
+        rule 为选择性同步规则时只同步该子目录；未指定且配置了规则时依次同步所有启用的子目录。
+        """
+        if rule is None and self.subtree_rules:
+            for subtree_rule in self.subtree_rules:
+                if subtree_rule['interval'] > 0:
+                    self.sync_files(subtree_rule)
+            return
+            
+        self.governor.apply_thread_priority()
+        self.scope = rule['path'] if rule else ''
+        self.pruned = frozenset(rule['pruned']) if rule else frozenset()
+        if self.trace:
+            self.trace.record_cycle(self.scope, self.pruned)
+        started = time.monotonic()
+        status = 'ok'
         try:
             sync_mode = self.config.get('sync_mode', 'mirror')
-            self.log_callback(f"开始同步检查 - 模式: {sync_mode}")
+            if self.scope:
+                self.log_callback(f"开始同步检查 - 模式: {sync_mode}, 子目录: {self.scope}")
+            else:
+                self.log_callback(f"开始同步检查 - 模式: {sync_mode}")
             
             # 验证排除规则
             self.validate_exclude_rules()
             
+            # 单向同步不维护基线，之后再用镜像模式时从头建立
+            if sync_mode != 'mirror':
+                BaselineStore.discard(self.config.get('server_url', ''), self.config.get('local_folder', ''))
+            
             if sync_mode == 'mirror':
                 self.mirror_sync()
             elif sync_mode == 'local':
@@ -78,12 +406,40 @@ class SyncEngine:
                 self.server_to_local_sync()
                 
             self.log_callback("同步检查完成")
+            if self.journal:
+                self.journal.record_end()
             
+        except SyncCancelled:
+            status = 'cancelled'
+            self.log_callback("同步已中止")
+            raise
         except Exception as e:
-            self.log_callback(f"同步过程出错: {str(e)}")
+            status = 'error'
+            self.logger.error(f"同步过程出错: {str(e)}")
+            self.emit(SyncError(self.config.get('server_url', ''), str(e)))
+        finally:
+            if self.events is not None:
+                with self.stats_lock:
+                    stats = dict(self.stats)
+                self.emit(CycleSummary(self.config.get('server_url', ''), self.scope, status,
+                                       time.monotonic() - started, stats))
+            # 保存本次上传/删除后失效的目录缓存
+            self.listing_cache.save()
+            self.hash_state.save()
+            if self.baseline:
+                self.baseline.commit()
+            if self.trace:
+                if self._traced_scan:
+                    self.trace.record_scan(*self._traced_scan)
+                    self._traced_scan = None
+                self.trace.flush()
             
     def mirror_sync(self):
         """镜像同步模式 - 改进版本"""
+        if self.config.get('streaming_diff', False):
+            self.streaming_mirror_sync()
+            return
+            
         self.log_callback("开始智能镜像同步...")
         
         # 获取本地文件列表
@@ -93,41 +449,55 @@ class SyncEngine:
         
         # 获取服务器文件列表
         self.log_callback("获取服务器文件列表...")
-        server_files = self.get_server_files()
+        server_files = self.get_server_files([f['path'] for f in local_files])
         self.log_callback(f"服务器文件数量: {len(server_files)}")
+        self.resolve_local_hashes(local_files)
         
         if not server_files and not local_files:
             self.log_callback("本地和服务器都没有文件")
             return
         
         # 创建文件状态映射
-        all_files = set()
         local_file_map = {f['path']: f for f in local_files}
         server_file_map = server_files
         
-        # 收集所有文件路径
-        all_files.update(local_file_map.keys())
-        all_files.update(server_file_map.keys())
+        # 收集所有文件路径（列式比较时内容相同的文件批量跳过，只逐个分析其余文件）
+        if self.baseline:
+            self.baseline.begin_seen()
+        identical = 0
+        if self.config.get('columnar_diff', True):
+            identical, all_files = self.skip_identical_files(local_files, server_files)
+        else:
+            all_files = set(local_file_map)
+            all_files.update(server_file_map)
         
         sync_actions = {
             'upload': [],
             'download': [],
             'skip': [],
-            'conflict': []
+            'conflict': [],
+            'delete_server': [],
+            'delete_local': []
         }
         
         # 分析每个文件的同步策略
         for file_path in all_files:
             local_file = local_file_map.get(file_path)
             server_file = server_file_map.get(file_path)
+            base = self.plan_baseline(file_path)
             
-            action = self.determine_sync_action(file_path, local_file, server_file)
+            action = self.determine_sync_action(file_path, local_file, server_file, base)
+            if action['type'] == 'skip':
+                self.refresh_baseline(file_path, local_file, server_file, base)
+            else:
+                action, server_file = self.confirm_server_state(file_path, local_file, server_file, base, action)
             sync_actions[action['type']].append({
                 'path': file_path,
                 'action': action,
                 'local': local_file,
                 'server': server_file
             })
+        self.finish_baseline_plan(sync_actions)
         
         # 执行同步操作
         self.execute_sync_actions(sync_actions)
@@ -135,13 +505,281 @@ class SyncEngine:
         # 统计结果
         upload_count = len(sync_actions['upload'])
         download_count = len(sync_actions['download'])
-        skip_count = len(sync_actions['skip'])
+        skip_count = len(sync_actions['skip']) + identical
         conflict_count = len(sync_actions['conflict'])
+        delete_count = len(sync_actions['delete_server']) + len(sync_actions['delete_local'])
+        
+        self.logger.info("镜像同步完成 - 上传:%d, 下载:%d, 删除:%d, 跳过:%d, 冲突:%d",
+                         upload_count, download_count, delete_count, skip_count, conflict_count,
+                         event='cycle.summary', upload=upload_count, download=download_count,
+                         delete=delete_count, skip=skip_count, conflict=conflict_count)
+        
+    def streaming_mirror_sync(self):
+        """流式镜像同步 - 本地和服务器按路径顺序归并，只保留需要执行的操作
+
+        不建立完整的本地/服务器文件列表和计划：跳过的文件只计数不保存，需要传输的操作按批次交给执行器。
+        注意逐个文件的状态仍随文件总数增长：目录缓存（listing_cache）保存所有子项并整体写入磁盘，
+        服务器内容索引（server_hash_index）、服务器文件大小集合（server_sizes）、已知服务器目录（remote_dirs）
+        和本次扫描见到的路径（hash_state.seen）也都包含每个文件或目录；省下的是文件列表和计划本身。
+        搜索接口需要事先知道所有本地文件名并一次性返回整个目录树，流式模式下不使用。
+        删除要等两边都遍历完、确认文件列表完整后才执行，因此删除操作要保存到最后。
+        """
+        self.log_callback("开始流式镜像同步...")
+        batch_size = self.config.get('streaming_batch_size', 500)
+        counts = {'upload': 0, 'download': 0, 'skip': 0, 'conflict': 0, 'delete_server': 0, 'delete_local': 0}
+        batch = {'upload': [], 'download': [], 'conflict': []}
+        deletes = {'delete_server': [], 'delete_local': []}
+        pending = 0
+        
+        if self.baseline:
+            self.baseline.begin_seen()
+        for file_path, local_file, server_file in self.merge_join(self.iter_local_files(), self.iter_server_files()):
+            self.token.check()
+            if local_file:
+                self.resolve_local_hashes([local_file])
+            base = self.plan_baseline(file_path)
+            action = self.determine_sync_action(file_path, local_file, server_file, base)
+            if action['type'] == 'skip':
+                counts['skip'] += 1
+                self.refresh_baseline(file_path, local_file, server_file, base)
+                continue
+            action, server_file = self.confirm_server_state(file_path, local_file, server_file, base, action)
+            counts[action['type']] += 1
+            if action['type'] == 'skip':
+                continue
+            if action['type'] in deletes:
+                deletes[action['type']].append({
+                    'path': file_path,
+                    'action': action,
+                    'local': local_file,
+                    'server': server_file
+                })
+                continue
+                
+            batch[action['type']].append({
+                'path': file_path,
+                'action': action,
+                'local': local_file,
+                'server': server_file
+            })
+            pending += 1
+            if pending >= batch_size:
+                self.execute_sync_actions(batch)
+                batch = {'upload': [], 'download': [], 'conflict': []}
+                pending = 0
+                
+        if pending:
+            self.execute_sync_actions(batch)
+        self.finish_baseline_plan(deletes)
+        if deletes['delete_server'] or deletes['delete_local']:
+            self.execute_sync_actions(deletes)
+            
+        delete_count = len(deletes['delete_server']) + len(deletes['delete_local'])
+        self.logger.info("镜像同步完成 - 上传:%d, 下载:%d, 删除:%d, 跳过:%d, 冲突:%d",
+                         counts['upload'], counts['download'], delete_count, counts['skip'], counts['conflict'],
+                         event='cycle.summary', upload=counts['upload'], download=counts['download'],
+                         delete=delete_count, skip=counts['skip'], conflict=counts['conflict'])
+        
+    @staticmethod
+    def merge_join(local_iter, server_iter):
+        """归并两个按路径排序的文件序列，产出 (路径, 本地文件, 服务器文件)"""
+        def sort_key(path):
+            return path.split('/')
+            
+        local_file = next(local_iter, None)
+        server_item = next(server_iter, None)
+        while local_file is not None or server_item is not None:
+            if server_item is None:
+                yield local_file['path'], local_file, None
+                local_file = next(local_iter, None)
+                continue
+            if local_file is None:
+                yield server_item[0], None, server_item[1]
+                server_item = next(server_iter, None)
+                continue
+                
+            local_key = sort_key(local_file['path'])
+            server_key = sort_key(server_item[0])
+            if local_key == server_key:
+                yield local_file['path'], local_file, server_item[1]
+                local_file = next(local_iter, None)
+                server_item = next(server_iter, None)
+            elif local_key < server_key:
+                yield local_file['path'], local_file, None
+                local_file = next(local_iter, None)
+            else:
+                yield server_item[0], None, server_item[1]
+                server_item = next(server_iter, None)
+        
+    def skip_identical_files(self, local_files, server_files):
+        """用列式快照批量找出两边内容相同的文件并跳过
+
+        两边hash相同的文件无论基线如何都不需要传输，只需在基线与当前状态不一致时更新基线
+        （与 refresh_baseline 相同，但比较是整列进行的）。返回 (跳过的数量, 其余需要逐个分析的路径)。
+        """
+        table = PathTable()
+        local_snapshot = FileSnapshot.from_local_files(table, local_files)
+        server_snapshot = FileSnapshot.from_server_files(table, server_files)
+        diff = diff_snapshots(local_snapshot, server_snapshot)
+        identical = len(diff.same_local)
+        
+        if self.logger.enabled(logging.DEBUG):
+            for index in diff.same_local:
+                path = local_snapshot.path(index)
+                self.logger.debug("跳过: %s - 文件内容相同，跳过同步", path, event='skip', path=path)
+                
+        if self.baseline and identical:
+            self.baseline.mark_seen_many(local_snapshot.path(index) for index in diff.same_local)
+            base_local, base_server = self.baseline.snapshots(table)
+            fresh = diff.matches_baseline(local_snapshot, server_snapshot, base_local, base_server)
+            for local_index, server_index, is_fresh in zip(diff.same_local, diff.same_server, fresh):
+                if not is_fresh:
+                    self.baseline.put(local_snapshot.path(local_index), local_snapshot.digest(local_index),
+                                      int(local_snapshot.sizes[local_index]), local_snapshot.mtime(local_index),
+                                      server_snapshot.mtime(server_index))
+                                      
+        return identical, [table.paths[path_id] for path_id in diff.other_ids]
+        
+    def confirm_server_state(self, file_path, local_file, server_file, base, action):
+        """会覆盖或删除服务器文件的操作依据的是缓存的目录列表时，重新获取所在目录的列表后再判断
+
+        目录的修改时间只反映直接子项的增删，文件被原地修改时缓存中的大小、修改时间和hash已经过时，
+        不能据此覆盖服务器上的修改。每个目录每轮最多重新获取一次。返回 (操作, 服务器文件)；
+        无法获取最新状态时本轮跳过该文件（不更新基线）。
+        """
+        if action['type'] not in SERVER_OVERWRITE_KINDS or not (server_file and server_file.get('cached')):
+            return action, server_file
+        try:
+            entry = self.fresh_server_entry(file_path)
+        except SyncCancelled:
+            raise
+        except Exception as e:
+            self.logger.warning(f"确认服务器文件状态失败 {file_path}: {str(e)}")
+            return {'type': 'skip', 'reason': '无法确认服务器文件的最新状态，本轮跳过'}, server_file
+            
+        fresh = None
+        if entry is not None and entry.get('path_type') == 'File':
+            if not entry.get('hash'):
+                entry['hash'] = self.get_server_file_hash(file_path)
+            fresh = {'hash': entry['hash'], 'size': entry.get('size', 0), 'mtime': entry.get('mtime', 0)}
+        if fresh is not None and all(fresh[key] == server_file.get(key) for key in fresh):
+            return action, fresh
+        self.logger.debug("服务器文件在缓存后已变化，重新判断: %s", file_path, event='server.changed', path=file_path)
+        return self.determine_sync_action(file_path, local_file, fresh, base), fresh
+        
+    def plan_baseline(self, file_path):
+        """返回文件的基线，并记录本轮见到了该路径"""
+        if self.baseline is None:
+            return None
+        self.baseline.mark_seen(file_path)
+        return self.baseline.get(file_path)
+        
+    def refresh_baseline(self, file_path, local_file, server_file, base):
+        """两边内容一致时记录基线（与已有记录相同时不写入）"""
+        if self.baseline is None or not local_file or not server_file:
+            return
+        file_hash = local_file.get('hash') or server_file.get('hash')
+        if base is None and not (file_hash and local_file.get('hash') == server_file.get('hash')):
+            return
+        entry = {
+            'hash': file_hash or base['hash'],
+            'size': local_file['size'],
+            'local_mtime': local_file.get('mtime'),
+            'server_mtime': server_file.get('mtime')
+        }
+        if entry != base:
+            self.baseline.put(file_path, entry['hash'], entry['size'], entry['local_mtime'], entry['server_mtime'])
+            
+    def finish_baseline_plan(self, sync_actions):
+        """文件列表不完整时取消删除操作；完整时清理两边都已不存在的路径的基线
+
+        通过搜索获取的目录树不包含名称不含查询字符串的服务器文件，同样按不完整处理，
+        删除和基线清理留到下一次完整遍历。
+        """
+        if self.baseline is None:
+            return
+        if self._walk_complete and self._local_complete and not self._walk_searched:
+            self.baseline.prune_unseen(self.scope, self.pruned)
+            return
+        skipped = len(sync_actions.get('delete_server', [])) + len(sync_actions.get('delete_local', []))
+        if skipped and self._walk_searched and self._walk_complete and self._local_complete:
+            self.logger.info(f"目录树通过搜索获取，{skipped} 个删除操作留到下一次完整遍历")
+        elif skipped:
+            self.logger.warning(f"⚠️ 文件列表获取不完整，本次跳过 {skipped} 个删除操作")
+        sync_actions['delete_server'] = []
+        sync_actions['delete_local'] = []
+        
+    def record_baseline(self, kind, item):
+        """操作成功后更新基线"""
+        if self.baseline is None:
+            return
+        path = item['path']
+        if kind in ('delete_server', 'delete_local'):
+            self.baseline.remove(path)
+            return
+        try:
+            stat = os.stat(Path(self.config['local_folder']) / path)
+        except OSError:
+            return
+        mtime = int(stat.st_mtime * 1000)
+        file_hash = self.hash_state.get(path, stat.st_size, mtime)
+        if file_hash is None:
+            # 传输后本地文件又被修改过，下一轮按两边都没有基线处理
+            self.baseline.remove(path)
+            return
+        server_mtime = (item.get('server') or {}).get('mtime') if kind == 'download' else None
+        self.baseline.put(path, file_hash, stat.st_size, mtime, server_mtime)
+        
+    def compare_with_baseline(self, file_info, base, mtime_key):
+        """文件与基线比较：不存在返回None，未修改返回True，已修改返回False
+
+        有hash时比较hash，否则比较大小和同一边上次记录的修改时间。
+        """
+        if file_info is None:
+            return None
+        if file_info.get('hash') and base['hash']:
+            return file_info['hash'] == base['hash']
+        if file_info.get('size') != base['size']:
+            return False
+        return base[mtime_key] is None or file_info.get('mtime') == base[mtime_key]
+        
+    def baseline_action(self, local_file, server_file, base):
+        """与上次同步时的状态三方比较，确定文件的同步操作"""
+        if (local_file and local_file.get('hash') is None and local_file['size'] == base['size']
+                and local_file.get('mtime') != base['local_mtime']):
+            # 只有修改时间变化时确认内容是否真的变了
+            self.ensure_local_hash(local_file)
+        local_same = self.compare_with_baseline(local_file, base, 'local_mtime')
+        server_same = self.compare_with_baseline(server_file, base, 'server_mtime')
         
-        self.log_callback(f"镜像同步完成 - 上传:{upload_count}, 下载:{download_count}, 跳过:{skip_count}, 冲突:{conflict_count}")
+        if local_same is None:
+            if server_same:
+                return {'type': 'delete_server', 'reason': '本地已删除，服务器文件未修改'}
+            return {'type': 'download', 'reason': '本地已删除，但服务器文件已修改，恢复到本地'}
+        if server_same is None:
+            if local_same:
+                return {'type': 'delete_local', 'reason': '服务器已删除，本地文件未修改'}
+            return {'type': 'upload', 'reason': '服务器已删除，但本地文件已修改，重新上传'}
+        if local_same and server_same:
+            return {'type': 'skip', 'reason': '两边都未修改，跳过同步'}
+        if server_same:
+            return {'type': 'upload', 'reason': '本地文件已修改'}
+        if local_same:
+            return {'type': 'download', 'reason': '服务器文件已修改'}
         
-    def determine_sync_action(self, file_path, local_file, server_file):
-        """确定文件的同步操作"""
+        local_hash = local_file.get('hash')
+        if local_hash and local_hash == server_file.get('hash'):
+            return {'type': 'skip', 'reason': '两边修改后内容相同，跳过同步'}
+        return {'type': 'conflict', 'reason': '上次同步后两边都修改了文件'}
+        
+    def determine_sync_action(self, file_path, local_file, server_file, base=None):
+        """确定文件的同步操作
+
+        base 为上次同步时的状态（镜像模式）时做三方比较，可以识别一边删除和两边都修改的情况；
+        没有基线时按内容和修改时间比较。
+        """
+        if base is not None:
+            return self.baseline_action(local_file, server_file, base)
         
         # 情况1: 只存在于本地
         if local_file and not server_file:
@@ -205,247 +843,1236 @@ class SyncEngine:
         }
     
     def execute_sync_actions(self, sync_actions):
-        """执行同步操作"""
-        
-        # 1. 先处理上传
-        for item in sync_actions['upload']:
-            self.log_callback(f"上传: {item['path']} - {item['action']['reason']}")
-            self.upload_file(item['local']['full_path'], item['path'])
+        """执行同步操作
+
+        上传、下载和冲突统一进入传输调度队列，按调度规则排序执行；删除在传输完成后执行。
+        """
+        uploads = sync_actions.get('upload', []) + sync_actions.get('conflict', [])
+        if self.journal:
+            self.journal.record_plan(sync_actions)
+        self.emit(PlanReady(self.config.get('server_url', ''),
+                            {kind: len(items) for kind, items in sync_actions.items()}))
         
-        # 2. 再处理下载
-        for item in sync_actions['download']:
-            self.log_callback(f"下载: {item['path']} - {item['action']['reason']}")
-            self.download_file(item['path'])
+        # 传输开始前一次性创建缺失的服务器目录
+        self.prepare_remote_directories(item['path'] for item in uploads)
         
-        # 3. 跳过的文件
-        for item in sync_actions['skip']:
-            self.log_callback(f"跳过: {item['path']} - {item['action']['reason']}")
+        # 跳过的文件
+        for item in sync_actions.get('skip', []):
+            self.logger.debug("跳过: %s - %s", item['path'], item['action']['reason'], event='skip', path=item['path'])
+            
+        scheduler = TransferScheduler(self.config)
+        for kind in ('upload', 'download', 'conflict'):
+            for item in sync_actions.get(kind, []):
+                scheduler.push(kind, item)
+                
+        workers = max(1, int(self.config.get('transfer_workers', 1)))
+        if workers == 1 or len(scheduler) <= 1:
+            self._transfer_worker(scheduler, None)
+        else:
+            # 第一个工作线程作为大文件专用通道，其余线程优先处理小文件
+            lanes = ['large'] + ['small'] * (workers - 1)
+            threads = [threading.Thread(target=self._transfer_worker, args=(scheduler, lane), daemon=True)
+                       for lane in lanes]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # 工作线程因停止而退出时，在这里继续向上传递
+            self.token.check()
+                
+        # 传输完成后执行删除（整个目录的删除只需一次请求）
+        for item in sync_actions.get('delete_server', []):
+            self.token.check()
+            if self.delete_server_file(item['path'], item.get('files')):
+                self.record_baseline('delete_server', item)
+                self._record_done(item)
+        deleted_dirs = set()
+        for item in sync_actions.get('delete_local', []):
+            self.token.check()
+            if self.delete_local_file(item['local']['full_path'], item.get('files')):
+                self.record_baseline('delete_local', item)
+                self._record_done(item)
+                deleted_dirs.add(item['path'].rpartition('/')[0])
+        self.remove_empty_local_dirs(deleted_dirs)
         
-        # 4. 冲突的文件
-        for item in sync_actions['conflict']:
-            self.log_callback(f"⚠️ 冲突: {item['path']} - {item['action']['reason']}")
-            # 对于冲突文件，可以选择保守策略：不做任何操作，或者以本地为准
-            # 这里选择以本地为准
-            self.log_callback(f"冲突解决: 以本地版本为准，上传 {item['path']}")
-            self.upload_file(item['local']['full_path'], item['path'])
+    def remove_empty_local_dirs(self, dirs):
+        """删除文件后统一清理变空的本地目录
+
+        从最深的目录开始逐级向上尝试删除，直到同步范围的根目录；非空目录删除失败，直接跳过。
+        """
+        candidates = set()
+        for rel_dir in dirs:
+            while rel_dir and rel_dir != self.scope and rel_dir not in candidates:
+                candidates.add(rel_dir)
+                rel_dir = rel_dir.rpartition('/')[0]
+        local_root = Path(self.config['local_folder'])
+        for rel_dir in sorted(candidates, key=lambda d: d.count('/'), reverse=True):
+            try:
+                os.rmdir(local_root / rel_dir)
+            except OSError:
+                pass
+                
+    def _record_done(self, item):
+        """在同步日志中记录操作已完成"""
+        if self.journal:
+            self.journal.record_done(item)
+            
+    def _transfer_worker(self, scheduler, lane):
+        """从调度队列中依次取出任务执行，直到队列为空或同步被停止"""
+        self.governor.apply_thread_priority()
+        while True:
+            try:
+                self.token.check()
+                kind, item = scheduler.pop(lane)
+                if kind is None:
+                    return
+                self.execute_transfer(kind, item)
+            except SyncCancelled:
+                if lane is None:
+                    raise
+                return
+            
+    def execute_transfer(self, kind, item):
+        """执行单个传输任务"""
+        started = time.monotonic()
+        success = False
+        if self.events is not None:
+            source = (item.get('server') if kind == 'download' else item.get('local')) or {}
+            self.emit(TransferStarted(self.config.get('server_url', ''), kind, item['path'], source.get('size', 0)))
+        try:
+            success = self._execute_transfer(kind, item)
+        finally:
+            if self.events is not None:
+                self.emit(TransferFinished(self.config.get('server_url', ''), kind, item['path'],
+                                           success, time.monotonic() - started))
+        if success:
+            self.record_baseline(kind, item)
+            self._record_done(item)
+            
+    def _execute_transfer(self, kind, item):
+        """执行传输，返回是否成功"""
+        success = False
+        if kind == 'upload':
+            self.log_callback(f"上传: {item['path']} - {item['action']['reason']}")
+            success = self.upload_file(item['local']['full_path'], item['path'], item['local'].get('hash'))
+        elif kind == 'download':
+            self.log_callback(f"下载: {item['path']} - {item['action']['reason']}")
+            success = self.download_file(item['path'], item.get('server'))
+        elif kind == 'conflict':
+            self.logger.warning(f"⚠️ 冲突: {item['path']} - {item['action']['reason']}")
+            # 以本地版本为准，覆盖前先把服务器版本另存为本地冲突副本（下一轮作为新文件上传）
+            if self.config.get('keep_conflict_copies', True) and item.get('server'):
+                copy_path = self.conflict_copy_path(item['path'])
+                self.log_callback(f"冲突解决: 服务器版本保存为 {copy_path}，上传本地版本 {item['path']}")
+                if not self.download_file(item['path'], item['server'], copy_path):
+                    return False
+            else:
+                self.log_callback(f"冲突解决: 以本地版本为准，上传 {item['path']}")
+            success = self.upload_file(item['local']['full_path'], item['path'], item['local'].get('hash'))
+        return success
+            
+    @staticmethod
+    def conflict_copy_path(rel_path):
+        """冲突副本的相对路径：同一目录下，文件名加上“冲突副本”和时间"""
+        directory, _, name = rel_path.rpartition('/')
+        stem, dot, ext = name.rpartition('.')
+        if not stem:
+            stem, dot, ext = name, '', ''
+        copy_name = f"{stem} (冲突副本 {time.strftime('%Y%m%d-%H%M%S')}){dot}{ext}"
+        return f"{directory}/{copy_name}" if directory else copy_name
                 
     def local_to_server_sync(self):
         """本地到服务器同步"""
         local_files = self.get_local_files()
-        server_files = self.get_server_files()
+        server_files = self.get_server_files([f['path'] for f in local_files])
+        self.resolve_local_hashes(local_files)
+        local_file_map = {f['path']: f for f in local_files}
+        
+        # 本地的重命名/移动在服务器上直接MOVE，不再重新上传
+        if self.move_detection_allowed():
+            self.apply_server_moves(detect_moves(server_files, local_file_map), server_files)
+        
+        sync_actions = {'upload': [], 'delete_server': []}
         
         # 上传本地文件
         for local_file in local_files:
-            rel_path = local_file['path']
-            if rel_path not in server_files or local_file['hash'] != server_files[rel_path].get('hash'):
-                self.upload_file(local_file['full_path'], rel_path)
+            server_file = server_files.get(local_file['path'])
+            if not server_file or not self.same_content(local_file, server_file):
+                sync_actions['upload'].append({
+                    'path': local_file['path'],
+                    'action': {'type': 'upload', 'reason': '本地文件与服务器不一致'},
+                    'local': local_file,
+                    'server': server_file
+                })
                 
         # 删除服务器上本地不存在的文件
-        for server_path in server_files:
-            if not any(f['path'] == server_path for f in local_files):
-                self.delete_server_file(server_path)
+        for server_path, server_info in server_files.items():
+            if server_path not in local_file_map:
+                sync_actions['delete_server'].append({
+                    'path': server_path,
+                    'action': {'type': 'delete_server', 'reason': '本地已删除'},
+                    'local': None,
+                    'server': server_info
+                })
+                
+        # 本地整个目录都已删除时，服务器上只删除一次该目录（本地目录读取失败时不合并）
+        if self._local_complete and sync_actions['delete_server']:
+            groups, sync_actions['delete_server'] = self.collapse_deleted_dirs(
+                sync_actions['delete_server'], local_file_map, set(self.pruned) | self.server_hidden_dirs)
+            for remote_dir, items in groups.items():
+                sync_actions['delete_server'].append({
+                    'path': remote_dir,
+                    'action': {'type': 'delete_server', 'reason': f'本地已删除整个目录 ({len(items)} 个文件)'},
+                    'local': None,
+                    'server': None,
+                    'files': len(items)
+                })
+                
+        self.execute_sync_actions(sync_actions)
                 
     def server_to_local_sync(self):
         """服务器到本地同步"""
         local_files = self.get_local_files()
-        server_files = self.get_server_files()
+        server_files = self.get_server_files([f['path'] for f in local_files])
+        self.resolve_local_hashes(local_files)
+        local_file_map = {f['path']: f for f in local_files}
+        
+        # 服务器上的重命名/移动在本地直接改名，不再重新下载
+        if self.move_detection_allowed():
+            self.apply_local_moves(detect_moves(local_file_map, server_files), local_file_map)
+        
+        sync_actions = {'download': [], 'delete_local': []}
         
         # 下载服务器文件
         for server_path, server_info in server_files.items():
-            local_file = next((f for f in local_files if f['path'] == server_path), None)
-            if not local_file or local_file['hash'] != server_info.get('hash'):
-                self.download_file(server_path)
+            local_file = local_file_map.get(server_path)
+            if not local_file or not self.same_content(local_file, server_info):
+                sync_actions['download'].append({
+                    'path': server_path,
+                    'action': {'type': 'download', 'reason': '服务器文件与本地不一致'},
+                    'local': local_file,
+                    'server': server_info
+                })
                 
-        # 删除本地服务器不存在的文件
-        for local_file in local_files:
+        # 删除本地服务器不存在的文件（服务器列表不完整时跳过，避免误删）
+        if not self._walk_complete:
+            self.logger.warning("⚠️ 服务器文件列表获取不完整，本次跳过本地删除")
+            local_file_map = {}
+        for local_file in local_file_map.values():
             if local_file['path'] not in server_files:
-                self.delete_local_file(local_file['full_path'])
+                sync_actions['delete_local'].append({
+                    'path': local_file['path'],
+                    'action': {'type': 'delete_local', 'reason': '服务器已删除'},
+                    'local': local_file,
+                    'server': None
+                })
                 
+        # 服务器上整个目录都已删除时，本地一次删除该目录（目录中的文件数必须与计划删除的一致）
+        if sync_actions['delete_local']:
+            groups, sync_actions['delete_local'] = self.collapse_deleted_dirs(
+                sync_actions['delete_local'], server_files, self.pruned)
+            local_root = Path(self.config['local_folder'])
+            for local_dir, items in groups.items():
+                full_path = local_root / local_dir
+                if self.count_local_files(full_path) != len(items):
+                    sync_actions['delete_local'].extend(items)
+                    continue
+                sync_actions['delete_local'].append({
+                    'path': local_dir,
+                    'action': {'type': 'delete_local', 'reason': f'服务器已删除整个目录 ({len(items)} 个文件)'},
+                    'local': {'path': local_dir, 'full_path': str(full_path)},
+                    'server': None,
+                    'files': len(items)
+                })
+                
+        self.execute_sync_actions(sync_actions)
+        
+    @staticmethod
+    def same_content(local_file, server_file):
+        """两边文件内容是否确定相同：先比较大小，任一边hash未知时按不同处理"""
+        if local_file['size'] != server_file.get('size'):
+            return False
+        local_hash = local_file.get('hash')
+        return bool(local_hash) and local_hash == server_file.get('hash')
+        
+    def collapse_deleted_dirs(self, items, survivors, blocked=()):
+        """把同一目录下的全部删除操作合并为删除整个目录
+
+        survivors 为删除后这一侧仍应存在的文件路径，blocked 为不能整体删除的目录（含有被排除
+        或不在本轮遍历范围内的内容）。不包含两者且不是同步范围根目录的目录可以整体删除，每个
+        文件归入可以整体删除的最上层目录。返回 ({目录: [文件操作]}, 不能合并的文件操作)。
+        """
+        keep = {''}
+        if self.scope:
+            keep.update(self._parent_dirs(self.scope + '/'))
+        for path in survivors:
+            keep.update(self._parent_dirs(path))
+        for path in blocked:
+            keep.add(path)
+            keep.update(self._parent_dirs(path))
+            
+        groups = {}
+        single = []
+        for item in items:
+            for parent in self._parent_dirs(item['path']):
+                if parent not in keep:
+                    groups.setdefault(parent, []).append(item)
+                    break
+            else:
+                single.append(item)
+        return groups, single
+        
+    @staticmethod
+    def _parent_dirs(path):
+        """路径的各级上级目录，从最上层开始（不含根目录）"""
+        parts = path.split('/')
+        return ['/'.join(parts[:i]) for i in range(1, len(parts))]
+        
+    @staticmethod
+    def count_local_files(dir_path):
+        """统计本地目录中的文件数（不跟随符号链接），无法读取时返回None"""
+        count = 0
+        try:
+            for _, _, files in os.walk(dir_path, onerror=_raise):
+                count += len(files)
+        except OSError:
+            return None
+        return count
+                
+    def move_detection_allowed(self):
+        """是否检测移动：与删除一样，本地或服务器的文件列表不完整时不检测
+
+        列表不完整时，某个目录中的文件看起来“不见了”，可能只是没有获取到，会被误判为移走。
+        """
+        if not self.config.get('detect_moves', True):
+            return False
+        if not (self._walk_complete and self._local_complete):
+            self.logger.warning("⚠️ 文件列表获取不完整，本次不检测移动")
+            return False
+        return True
+        
+    def apply_server_moves(self, moves, server_files):
+        """在服务器上执行移动操作，并同步更新服务器文件列表"""
+        for move in moves:
+            if self.move_server_path(move['src'], move['dst'], move['is_dir']):
+                for src, dst in move['files']:
+                    server_files[dst] = server_files.pop(src)
+                    file_hash = server_files[dst].get('hash')
+                    if self.server_hash_index.get(file_hash) == src:
+                        self.server_hash_index[file_hash] = dst
+                    
+    def apply_local_moves(self, moves, local_file_map):
+        """在本地执行移动操作，并同步更新本地文件列表"""
+        local_folder = Path(self.config['local_folder'])
+        for move in moves:
+            if self.move_local_path(move['src'], move['dst']):
+                for src, dst in move['files']:
+                    local_file = dict(local_file_map.pop(src))
+                    local_file['path'] = dst
+                    local_file['full_path'] = str(local_folder / dst)
+                    local_file_map[dst] = local_file
+                    if local_file.get('hash'):
+                        self.hash_state.put(dst, local_file['size'], local_file['mtime'], local_file['hash'])
+                    indexed = self.local_hash_index.get(local_file.get('hash'))
+                    if indexed and indexed[0] == str(local_folder / src):
+                        self.local_hash_index[local_file['hash']] = (
+                            local_file['full_path'], indexed[1], indexed[2])
+        
     def get_local_files(self):
         """获取本地文件列表"""
-        local_folder = Path(self.config['local_folder'])
-        files = []
-        
-        for file_path in local_folder.rglob('*'):
-            if file_path.is_file() and not self.is_excluded(file_path.name):
-                rel_path = file_path.relative_to(local_folder).as_posix()
-                file_hash = self.get_file_hash(file_path)
-                
-                # 获取文件修改时间（毫秒时间戳）
-                try:
-                    mtime = int(file_path.stat().st_mtime * 1000)
-                except:
-                    mtime = 0
-                
-                files.append({
-                    'path': rel_path,
-                    'full_path': str(file_path),
-                    'hash': file_hash,
-                    'mtime': mtime,
-                    'size': file_path.stat().st_size if file_path.exists() else 0
-                })
+        return list(self.iter_local_files())
+        
+    def iter_local_files(self):
+        """按路径顺序逐个产出本地文件（同一目录内按名称排序，深度优先）"""
+        started = time.monotonic()
+        traced = [] if self.trace else None
+        if self.local_snapshot is not None:
+            files, self.local_hash_index = self.local_snapshot.get(self)
+        else:
+            files = self.scan_local_files()
+        for count, local_file in enumerate(files, 1):
+            if traced is not None:
+                traced.append(local_file)
+            if self.events is not None and count % SCAN_PROGRESS_INTERVAL == 0:
+                self.emit(ScanProgress(self.config.get('server_url', ''), 'local', count))
+            yield local_file
+        if traced is not None:
+            # 按需计算的hash在扫描之后才填入，本轮同步结束时再写入录制文件
+            self._traced_scan = (traced, time.monotonic() - started)
+            
+    def scan_local_files(self):
+        """扫描本地文件夹，同时重建本地内容索引"""
+        local_folder = self.config['local_folder']
+        self.local_hash_index = {}
+        self.hash_state.begin_scan()
+        start = os.path.join(local_folder, *self.scope.split('/')) if self.scope else local_folder
+        # 本地文件夹不存在（如移动硬盘未连接）或有目录读取失败时，不能据此删除服务器文件
+        self._local_complete = os.path.isdir(start)
+        if self._local_complete:
+            yield from self._iter_local_dir(start, self.scope)
+        # 只有完整扫描了整个范围才能断定没见到的文件已不存在，否则保留它们的hash记录
+        if self._local_complete:
+            self.hash_state.end_scan(self.scope, self.pruned)
+        
+    def _iter_local_dir(self, dir_path, rel_dir):
+        """递归遍历单个本地目录"""
+        self.governor.wait_if_busy()
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            self.logger.warning(f"读取本地目录失败 {dir_path}: {str(e)}")
+            self._local_complete = False
+            return
+            
+        for entry in entries:
+            self.token.check()
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    # 由其他选择性同步规则负责的子目录不在这里遍历
+                    if rel_path not in self.pruned:
+                        yield from self._iter_local_dir(entry.path, rel_path)
+                    continue
+                # 跳过下载/复用过程中的临时文件
+                if not entry.is_file() or entry.name.endswith('.dufs_tmp') or self.is_excluded(entry.name):
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
                 
-        return files
+            local_file = {
+                'path': rel_path,
+                'full_path': entry.path,
+                'hash': None,
+                'mtime': int(stat.st_mtime * 1000),  # 毫秒时间戳
+                'size': stat.st_size
+            }
+            local_file['hash'] = self.hash_state.get(rel_path, stat.st_size, local_file['mtime'])
+            if local_file['hash'] is None and not self.config.get('hash_while_upload', True):
+                self.ensure_local_hash(local_file)
+            elif local_file['hash']:
+                self.local_hash_index.setdefault(
+                    local_file['hash'], (entry.path, stat.st_size, local_file['mtime']))
+            yield local_file
         
-    def get_server_files(self):
+    def get_server_files(self, local_paths=None):
         """获取服务器文件列表（递归获取所有文件）"""
         try:
-            files = {}
-            self._get_server_files_recursive('', files)
-            return files
+            return dict(self.iter_server_files(local_paths, ordered=False))
             
+        except SyncCancelled:
+            raise
         except Exception as e:
-            self.log_callback(f"获取服务器文件列表失败: {str(e)}")
+            self.logger.warning(f"获取服务器文件列表失败: {str(e)}")
+            self._walk_complete = False
             return {}
             
-    def _get_server_files_recursive(self, path, files):
-        """递归获取服务器文件列表"""
+    def iter_server_files(self, local_paths=None, ordered=True):
+        """按路径顺序逐个产出服务器文件 (路径, 文件信息)，排序规则与本地遍历一致
+
+        local_paths 为本地文件路径列表时，服务器支持搜索接口的情况下用搜索代替逐目录获取列表。
+        ordered 为False时不要求顺序，目录列表中的文件边接收边产出。
+        """
+        self._ordered_walk = ordered
+        self._fresh_listings = {}
+        with self.remote_dirs_lock:
+            self.remote_dirs = {''}
+        self.server_hidden_dirs = set()
+        self.server_hash_index = {}
+        self.server_sizes = set()
+        full_walk = self.listing_cache.begin_walk(self.scope, self.pruned)
+        if full_walk:
+            self.log_callback("执行完整目录遍历")
+        self._walk_complete = True
+        self._walk_searched = False
+        self._search_groups = None
+        if not full_walk and local_paths is not None and self.search_listing_supported():
+            try:
+                self._search_groups = self.fetch_search_listing(local_paths)
+            except SyncCancelled:
+                raise
+            except Exception as e:
+                self.logger.warning(f"搜索接口获取目录树失败，改为逐个目录获取: {str(e)}")
         try:
-            # 构建URL，根目录时不需要路径
-            if path:
-                url = urljoin(self.config['server_url'], f"{quote(path)}?json")
-            else:
-                url = urljoin(self.config['server_url'], "?json")
-                
-            self.log_callback(f"获取目录列表: {path if path else '根目录'}")
-            response = self.session.get(url)
+            for count, entry in enumerate(self._get_server_files_recursive(self.scope), 1):
+                if self.events is not None and count % SCAN_PROGRESS_INTERVAL == 0:
+                    self.emit(ScanProgress(self.config.get('server_url', ''), 'server', count))
+                yield entry
+        finally:
+            # 搜索结果不包含所有文件，不用来清理缓存中已不存在的目录，也不作为删除的依据
+            self._walk_searched = self._search_groups is not None
+            self._search_groups = None
+        self.listing_cache.end_walk(self._walk_complete and not self._walk_searched)
+        
+    def search_listing_supported(self):
+        """判断是否使用搜索接口获取目录树（首次调用时探测服务器是否支持）"""
+        strategy = self.config.get('listing_strategy', 'auto')
+        if strategy == 'walk' or not self.search_queries():
+            return False
+        if strategy == 'search':
+            return True
+        if self.search_supported is None:
+            self.search_supported = self.probe_search_support()
+            if self.search_supported:
+                self.log_callback("服务器支持搜索接口，目录树将通过搜索一次获取")
+            elif self.search_supported is False:
+                self.log_callback("服务器不支持搜索接口，逐个目录获取列表")
+        return bool(self.search_supported)
+        
+    def probe_search_support(self):
+        """用一个不会匹配任何文件的查询探测搜索接口，无法判断时返回None（下次再探测）
+
+        dufs 未开启 --allow-search 时会忽略查询参数并返回普通目录列表，
+        因此搜索结果为空且根目录不为空时才认为支持。
+        """
+        try:
+            url = urljoin(self.config['server_url'], f"?q={quote(SEARCH_PROBE_QUERY)}&json")
+            response = self.session.get(url, timeout=10)
+            if response.status_code != 200 or response.json().get('paths'):
+                return False
+            response = self.session.get(urljoin(self.config['server_url'], "?json"), timeout=10)
             response.raise_for_status()
+            return True if response.json().get('paths') else None
+        except Exception:
+            return None
             
-            server_data = response.json()
-            paths = server_data.get('paths', [])
-            self.log_callback(f"找到 {len(paths)} 个项目")
-            
-            for item in paths:
-                item_name = item['name']
-                item_path = f"{path}/{item_name}" if path else item_name
-                
-                if item.get('path_type') == 'File':
-                    # 跳过被排除的文件
-                    if self.is_excluded(item_name):
-                        self.log_callback(f"跳过被排除的文件: {item_name}")
-                        continue
-                        
-                    # 获取文件hash
-                    try:
-                        hash_url = urljoin(self.config['server_url'], f"{quote(item_path)}?hash")
-                        hash_response = self.session.get(hash_url, timeout=10)
-                        file_hash = hash_response.text.strip() if hash_response.status_code == 200 else None
-                    except Exception as e:
-                        self.log_callback(f"获取文件hash失败 {item_path}: {str(e)}")
-                        file_hash = None
-                    
-                    files[item_path] = {
-                        'hash': file_hash,
-                        'size': item.get('size', 0),
-                        'mtime': item.get('mtime', 0)  # dufs提供的修改时间
-                    }
-                    self.log_callback(f"发现文件: {item_path} (大小: {item.get('size', 0)} 字节, 修改时间: {item.get('mtime', 0)})")
-                    
-                elif item.get('path_type') == 'Dir':
-                    # 递归获取子目录
-                    self.log_callback(f"进入子目录: {item_path}")
-                    self._get_server_files_recursive(item_path, files)
+    def search_queries(self):
+        """搜索用的查询字符串（文件名包含其中任意一个即可被搜到）"""
+        return [q for q in self.config.get('search_listing_queries', ['.']) if q]
+        
+    def fetch_search_listing(self, local_paths):
+        """通过dufs搜索接口获取同步范围内的目录树，返回 {目录: {名称: 子项}}
+
+        搜索按文件名子串匹配，名称不包含任何查询字符串的文件搜不到：本地有这类文件的目录
+        单独获取完整列表，只存在于服务器上的这类文件由定期的完整遍历发现。
+        服务器忽略查询参数或同步范围不存在时返回None，改为逐个目录获取。
+        """
+        queries = self.search_queries()
+        lowered = [q.lower() for q in queries]
+        found = {}
+        for query in queries:
+            self.token.check()
+            url = urljoin(self.config['server_url'], f"{quote(self.scope)}?q={quote(query)}&json")
+            self.log_callback(f"搜索目录树: {self.scope if self.scope else '根目录'} (查询: {query})")
+            response = self.session.get(url, timeout=self.timeout)
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            for item in response.json().get('paths', []):
+                name = item['name'].replace('\\', '/').strip('/')
+                if query.lower() not in name.rsplit('/', 1)[-1].lower():
+                    # 返回的是普通目录列表，说明服务器没有开启搜索
+                    self.search_supported = False
+                    self.log_callback("服务器忽略了搜索参数，改为逐个目录获取列表")
+                    return None
+                found[f"{self.scope}/{name}" if self.scope else name] = item
+                
+        groups = {}
+        previous = {}
+        for path, item in found.items():
+            if any(path.startswith(p + '/') for p in self.pruned):
+                continue
+            parent, _, name = path.rpartition('/')
+            if parent not in previous:
+                previous[parent] = self.listing_cache.previous_entries(parent)
+            entry = {
+                'name': name,
+                'path_type': item.get('path_type'),
+                'size': item.get('size', 0),
+                'mtime': item.get('mtime', 0)
+            }
+            file_hash = self.listing_cache.reusable_hash(previous[parent].get(name), entry)
+            if file_hash:
+                entry['hash'] = file_hash
+            groups.setdefault(parent, {})[name] = entry
+            self._add_search_parents(groups, parent)
+            
+        # 本地有搜不到的文件的目录，单独获取完整列表
+        uncovered = set()
+        for local_path in local_paths:
+            parent, _, name = local_path.rpartition('/')
+            if not any(q in name.lower() for q in lowered):
+                uncovered.add(parent)
+        for path in sorted(uncovered):
+            self.token.check()
+            try:
+                entries = self._fetch_server_listing(path)
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    continue
+                raise
+            self.listing_cache.put(path, None, entries)
+            groups[path] = {entry['name']: entry for entry in entries}
+            self._add_search_parents(groups, path)
+            
+        # 保存搜索到的hash，保留缓存中搜不到的子项以便完整遍历时复用hash
+        for path, group in groups.items():
+            if path in uncovered:
+                continue
+            merged = self.listing_cache.previous_entries(path)
+            merged.update(group)
+            self.listing_cache.put(path, None, list(merged.values()))
+            
+        self.log_callback(f"搜索获取到 {len(found)} 个项目，另外单独获取 {len(uncovered)} 个目录")
+        return groups
+        
+    def _add_search_parents(self, groups, path):
+        """把目录及其上级目录加入所在目录的子项（文件存在则其上级目录必然存在）"""
+        while path != self.scope and path:
+            parent, _, name = path.rpartition('/')
+            groups.setdefault(parent, {}).setdefault(name, {'name': name, 'path_type': 'Dir', 'size': 0, 'mtime': None})
+            path = parent
+            
+    def _get_server_files_recursive(self, path, dir_mtime=None):
+        """递归获取服务器文件列表
+
+        目录修改时间与缓存一致时复用缓存的子项列表；任一目录获取失败时本次遍历记为不完整。
+        从服务器获取列表且不要求顺序时，文件在列表接收过程中就逐个处理和产出，子目录在列表完整后再进入。
+        """
+        self.token.check()
+        streamed = False
+        cached = False
+        try:
+            if self._search_groups is not None:
+                entries = list(self._search_groups.get(path, {}).values())
+            else:
+                entries = self.listing_cache.get(path, dir_mtime)
+                if entries is None:
+                    entries = []
+                    streamed = not self._ordered_walk
+                    for item in self._stream_server_listing(path):
+                        entries.append(item)
+                        if streamed and item.get('path_type') == 'File':
+                            yield from self._server_file_entry(path, item)
+                    self.listing_cache.put(path, dir_mtime, entries)
+                else:
+                    cached = True
+                    self.logger.debug("目录未变化，使用缓存: %s", path if path else '根目录', event='listing.cached', path=path)
+        except SyncCancelled:
+            raise
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                # 目录在服务器上不存在，视为空目录
+                self.logger.debug("服务器目录不存在: %s", path, event='listing.missing', path=path)
+            else:
+                self.logger.warning(f"获取目录 {path if path else '根目录'} 失败: {str(e)}")
+                self._walk_complete = False
+            return
+        except Exception as e:
+            self.logger.warning(f"获取目录 {path if path else '根目录'} 失败: {str(e)}")
+            self._walk_complete = False
+            return
+            
+        if path and path == self.scope:
+            # 子目录存在，其上级目录也必然存在
+            parts = path.split('/')
+            with self.remote_dirs_lock:
+                self.remote_dirs.update('/'.join(parts[:i]) for i in range(1, len(parts) + 1))
+            
+        for item in sorted(entries, key=lambda entry: entry['name']):
+            if item.get('path_type') == 'File':
+                if not streamed:
+                    yield from self._server_file_entry(path, item, cached)
                     
+            elif item.get('path_type') == 'Dir':
+                # 递归获取子目录
+                item_path = f"{path}/{item['name']}" if path else item['name']
+                with self.remote_dirs_lock:
+                    self.remote_dirs.add(item_path)
+                if item_path in self.pruned:
+                    continue
+                self.logger.debug("进入子目录: %s", item_path, event='server.dir', path=item_path)
+                yield from self._get_server_files_recursive(item_path, item.get('mtime'))
+                
+    def _server_file_entry(self, path, item, cached=False):
+        """处理目录列表中的一个文件：被排除时不产出，否则产出 (路径, 文件信息)
+
+        cached 为True表示来自缓存的目录列表，文件信息中带 'cached' 标记（见 confirm_server_state）。
+        """
+        item_name = item['name']
+        item_path = f"{path}/{item_name}" if path else item_name
+        
+        # 跳过被排除的文件
+        if self.is_excluded(item_name) or item_name.startswith(PROBE_FILE_PREFIX):
+            self.server_hidden_dirs.add(path)
+            self.logger.debug("跳过被排除的文件: %s", item_name, event='server.excluded', path=item_path)
+            return
+            
+        # 获取文件hash（大小和修改时间未变化时复用上次的hash）
+        if not item.get('hash'):
+            self.token.check()
+            item['hash'] = self.get_server_file_hash(item_path)
+        
+        self.logger.debug("发现文件: %s (大小: %s 字节, 修改时间: %s)",
+                          item_path, item.get('size', 0), item.get('mtime', 0), event='server.file', path=item_path)
+        self.server_sizes.add(item.get('size', 0))
+        if item['hash']:
+            self.server_hash_index.setdefault(item['hash'], item_path)
+        server_file = {
+            'hash': item['hash'],
+            'size': item.get('size', 0),
+            'mtime': item.get('mtime', 0)  # dufs提供的修改时间
+        }
+        if cached:
+            server_file['cached'] = True
+        yield item_path, server_file
+        
+    def _fetch_server_listing(self, path):
+        """从服务器获取单个目录的子项列表"""
+        return list(self._stream_server_listing(path))
+        
+    def _stream_server_listing(self, path):
+        """从服务器获取单个目录的子项，边接收边解析并逐个产出
+
+        响应按数据块解析（见 listing_parser），不需要先读入整个响应；大小和修改时间与上次列表
+        一致的文件直接带上上次的hash。
+        """
+        # 构建URL，根目录时不需要路径
+        if path:
+            url = urljoin(self.config['server_url'], f"{quote(path)}?json")
+        else:
+            url = urljoin(self.config['server_url'], "?json")
+            
+        self.logger.debug("获取目录列表: %s", path if path else '根目录', event='listing.fetch', path=path)
+        count = 0
+        with self.session.get(url, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            previous = self.listing_cache.previous_entries(path)
+            for item in iter_listing_paths(response.iter_content(chunk_size=LISTING_CHUNK_SIZE)):
+                entry = {
+                    'name': item['name'],
+                    'path_type': item.get('path_type'),
+                    'size': item.get('size', 0),
+                    'mtime': item.get('mtime', 0)
+                }
+                file_hash = self.listing_cache.reusable_hash(previous.get(entry['name']), entry)
+                if file_hash:
+                    entry['hash'] = file_hash
+                count += 1
+                yield entry
+        self.logger.debug("找到 %d 个项目", count, event='listing.done', path=path, count=count)
+        
+    def get_server_file_hash(self, item_path):
+        """获取服务器文件的hash"""
+        try:
+            hash_url = urljoin(self.config['server_url'], f"{quote(item_path)}?hash")
+            hash_response = self.session.get(hash_url, timeout=10)
+            return hash_response.text.strip() if hash_response.status_code == 200 else None
         except Exception as e:
-            self.log_callback(f"获取目录 {path if path else '根目录'} 失败: {str(e)}")
+            self.logger.warning(f"获取文件hash失败 {item_path}: {str(e)}")
+            return None
             
-    def upload_file(self, local_path, remote_path):
-        """上传文件到服务器"""
+    def upload_file(self, local_path, remote_path, file_hash=None):
+        """上传文件到服务器
+
+        服务器上已有相同内容（或本轮已上传过相同内容）时，改为服务器端COPY。
+        """
+        dedup = bool(file_hash) and self.config.get('dedup_uploads', True)
+        if dedup:
+            source = self._claim_upload_hash(file_hash)
+            if source:
+                if source == remote_path:
+                    return True
+                if self.copy_server_file(source, remote_path, local_path, file_hash):
+                    return True
+                # 复制失败或复制结果与本地内容不一致时按普通上传处理
+                self._claim_upload_hash(file_hash, force=True)
+                
         try:
-            # 确保远程目录存在
+            # 确保远程目录存在（已知目录不再发送MKCOL）
             remote_dir = '/'.join(remote_path.split('/')[:-1])
-            if remote_dir:
-                self.create_remote_directory(remote_dir)
+            self.ensure_remote_directory(remote_dir)
             
             url = urljoin(self.config['server_url'], quote(remote_path))
             
             with open(local_path, 'rb') as f:
-                response = self.session.put(url, data=f)
+                before = os.fstat(f.fileno())
+                size = before.st_size
+                transport = 'sendfile' if self.use_sendfile(url, size) else 'requests'
+                started = time.monotonic()
+                response, hasher = self._put_file(url, f, size, remote_path, transport)
+                if response.status_code in (404, 409) and remote_dir:
+                    # 目录可能已被其他客户端删除，重新创建后重试一次
+                    self.forget_remote_directory(remote_dir)
+                    self.ensure_remote_directory(remote_dir)
+                    started = time.monotonic()
+                    response, hasher = self._put_file(url, f, size, remote_path, transport)
                 response.raise_for_status()
+                elapsed = time.monotonic() - started
+            after = os.stat(local_path)
+            unchanged = after.st_size == before.st_size and after.st_mtime_ns == before.st_mtime_ns
+                
+            self.listing_cache.invalidate(remote_path)
+            if hasher is not None:
+                sent_hash = hasher.hexdigest()
+                if not self.verify_upload(remote_path, sent_hash):
+                    return False
+            elif file_hash:
+                # sendfile 发送的内容不经过用户空间，用扫描时的hash校验
+                sent_hash = file_hash
+                if not self.verify_upload(remote_path, sent_hash):
+                    return False
+            else:
+                # 没有已知的hash时采用服务器计算的hash（上传过程中文件被修改则不记录）
+                sent_hash = self.get_server_file_hash(remote_path) if unchanged else None
+            if sent_hash:
+                self.listing_cache.put_file_hash(remote_path, size, sent_hash)
+            
+            # 上传过程中文件未被修改时记录hash，下一轮不必重新计算
+            if unchanged and sent_hash:
+                self.hash_state.put(remote_path, size, int(after.st_mtime * 1000), sent_hash)
+                
+            rate = size / max(elapsed, 1e-6) / (1024 * 1024)
+            self.logger.info("上传成功: %s (%.1f MB/秒, %s)", remote_path, rate, transport, event='upload.done',
+                             path=remote_path, size=size, transport=transport, seconds=round(elapsed, 3),
+                             mbps=round(rate, 2))
+            self.add_stat('uploaded')
+            if sent_hash and self.config.get('dedup_uploads', True):
+                with self.dedup_lock:
+                    self.server_hash_index.setdefault(sent_hash, remote_path)
+            return True
+            
+        except SyncCancelled:
+            self.log_callback(f"上传已中止: {remote_path}")
+            raise
+        except Exception as e:
+            self.logger.warning(f"上传失败 {remote_path}: {str(e)}")
+            return False
+        finally:
+            if dedup:
+                self._release_upload_hash(file_hash)
+            
+    def use_sendfile(self, url, size):
+        """是否用 sendfile 上传（小于一个数据块的文件用普通上传，可以复用连接）"""
+        return self.sendfile is not None and size >= self.chunk_size and self.sendfile.supports(url)
+        
+    def _put_file(self, url, f, size, remote_path, transport):
+        """从头发送一次PUT请求，返回 (响应, 发送内容的hash计算器)
+
+        普通上传每读取一个数据块检查一次停止/暂停，同时计算实际发送内容的hash；
+        sendfile 上传的内容不经过用户空间，hash计算器为None。
+        """
+        f.seek(0)
+        if transport == 'sendfile':
+            on_progress = None
+            if self.events is not None:
+                on_progress = lambda sent: self.emit(
+                    TransferProgress(self.config.get('server_url', ''), 'upload', remote_path, sent, size))
+            return self.sendfile.put(url, f, size, self.token, on_progress), None
+        hasher = hashlib.sha256()
+        reader = CancellableReader(f, self.token, size, self._upload_reader(hasher, remote_path, size),
+                                   self.chunk_size)
+        return self.session.put(url, data=reader, timeout=self.timeout), hasher
+        
+    def _upload_reader(self, hasher, remote_path, size):
+        """上传时每读取一个数据块的处理：计算hash，有事件队列时报告进度"""
+        if self.events is None:
+            return hasher.update
+        sent = 0
+        
+        def on_read(data):
+            nonlocal sent
+            hasher.update(data)
+            sent += len(data)
+            self.emit(TransferProgress(self.config.get('server_url', ''), 'upload', remote_path, sent, size))
+        return on_read
+        
+    def verify_upload(self, remote_path, sent_hash):
+        """上传后用服务器的 ?hash 校验内容，服务器不提供hash时视为通过"""
+        if not self.config.get('verify_uploads', True):
+            return True
+        server_hash = self.get_server_file_hash(remote_path)
+        if server_hash and server_hash != sent_hash:
+            self.logger.warning(f"上传校验失败 {remote_path}: 服务器hash {server_hash} 与发送内容 {sent_hash} 不一致")
+            return False
+        return True
+        
+    def _claim_upload_hash(self, file_hash, force=False):
+        """返回服务器上已有相同内容的路径；否则登记当前线程负责上传该内容并返回None
+
+        其他线程正在上传相同内容时等待其完成后再判断；force为True时不再查找已有内容。
+        """
+        while True:
+            with self.dedup_lock:
+                source = None if force else self.server_hash_index.get(file_hash)
+                if source:
+                    return source
+                event = self.uploading_hashes.get(file_hash)
+                if event is None:
+                    self.uploading_hashes[file_hash] = threading.Event()
+                    return None
+            event.wait()
+            
+    def _release_upload_hash(self, file_hash):
+        """结束当前线程对该内容的上传登记，唤醒等待的线程"""
+        with self.dedup_lock:
+            event = self.uploading_hashes.pop(file_hash, None)
+        if event:
+            event.set()
+            
+    def copy_server_file(self, src_path, dst_path, local_path, file_hash):
+        """通过WebDAV COPY在服务器上复制已有内容，代替重新上传
+
+        服务器内容索引可能已经过时（源文件被其他客户端修改过），复制后用目标的 ?hash 与本地hash比较，
+        服务器不提供hash时至少比较大小；不一致时返回False，由调用方改为普通上传覆盖。
+        """
+        try:
+            size = os.path.getsize(local_path)
+            dst_dir = '/'.join(dst_path.split('/')[:-1])
+            self.ensure_remote_directory(dst_dir)
+            
+            url = urljoin(self.config['server_url'], quote(src_path))
+            destination = urljoin(self.config['server_url'], quote(dst_path))
+            response = self.session.request('COPY', url, headers={'Destination': destination}, timeout=self.timeout)
+            response.raise_for_status()
+            self.listing_cache.invalidate(dst_path)
+            
+            server_hash = self.get_server_file_hash(dst_path)
+            if server_hash is None:
+                head = self.session.head(destination, timeout=self.timeout)
+                head.raise_for_status()
+                copied_size = head.headers.get('Content-Length')
+                matched = copied_size is not None and int(copied_size) == size
+            else:
+                matched = server_hash == file_hash
+            if not matched:
+                # 索引中的源文件内容已经变化，不再用它复制
+                with self.dedup_lock:
+                    if self.server_hash_index.get(file_hash) == src_path:
+                        del self.server_hash_index[file_hash]
+                self.logger.warning(f"服务器复制结果与本地内容不一致，改为上传: {src_path} -> {dst_path}")
+                return False
                 
-            self.log_callback(f"上传成功: {remote_path}")
-            self.stats['uploaded'] += 1
-            self.update_stats()
+            self.listing_cache.put_file_hash(dst_path, size, file_hash)
+            self.log_callback(f"服务器复制成功（内容已存在，无需上传）: {src_path} -> {dst_path}")
+            self.add_stat('uploaded')
+            return True
             
         except Exception as e:
-            self.log_callback(f"上传失败 {remote_path}: {str(e)}")
+            self.logger.warning(f"服务器复制失败 {src_path} -> {dst_path}: {str(e)}")
+            return False
+            
+    def prepare_remote_directories(self, remote_paths):
+        """为待上传的文件一次性创建缺失的服务器目录（父目录优先）"""
+        needed = set()
+        for remote_path in remote_paths:
+            parts = remote_path.split('/')[:-1]
+            for i in range(1, len(parts) + 1):
+                needed.add('/'.join(parts[:i]))
+        with self.remote_dirs_lock:
+            missing = sorted(needed - self.remote_dirs, key=lambda d: (d.count('/'), d))
+        if missing:
+            self.log_callback(f"创建服务器目录: {len(missing)} 个")
+        for remote_dir in missing:
+            self.ensure_remote_directory(remote_dir)
             
+    def ensure_remote_directory(self, remote_dir):
+        """确保服务器目录存在，按父目录优先的顺序创建缺失的各级目录"""
+        with self.remote_dirs_lock:
+            if remote_dir in self.remote_dirs:
+                return True
+        parts = remote_dir.split('/')
+        for i in range(1, len(parts) + 1):
+            current = '/'.join(parts[:i])
+            with self.remote_dirs_lock:
+                if current in self.remote_dirs:
+                    continue
+            if not self.create_remote_directory(current):
+                return False
+        return True
+        
+    def forget_remote_directory(self, remote_dir):
+        """从已知目录集合中移除目录及其所有子目录"""
+        prefix = remote_dir + '/'
+        with self.remote_dirs_lock:
+            self.remote_dirs = {d for d in self.remote_dirs
+                                if d != remote_dir and not d.startswith(prefix)}
+            self.remote_dirs.add('')
+        
     def create_remote_directory(self, remote_dir):
         """创建远程目录"""
         try:
             url = urljoin(self.config['server_url'], quote(remote_dir))
-            response = self.session.request('MKCOL', url)
+            response = self.session.request('MKCOL', url, timeout=self.timeout)
             # 目录已存在时返回405，这是正常的
             if response.status_code not in [201, 405]:
                 response.raise_for_status()
+            with self.remote_dirs_lock:
+                self.remote_dirs.add(remote_dir)
+            self.listing_cache.invalidate(remote_dir)
+            return True
         except Exception as e:
-            self.log_callback(f"创建目录失败 {remote_dir}: {str(e)}")
+            self.logger.warning(f"创建目录失败 {remote_dir}: {str(e)}")
+            return False
             
-    def download_file(self, remote_path):
-        """从服务器下载文件"""
+    def download_file(self, remote_path, server_file=None, local_rel_path=None):
+        """从服务器下载文件
+
+        local_rel_path 为保存到的本地相对路径（默认与服务器路径相同）。
+        本地已有相同hash的文件时直接复制/硬链接，不再从服务器下载。
+        """
+        local_rel_path = local_rel_path or remote_path
+        if server_file and self.reuse_local_content(local_rel_path, server_file):
+            return True
+            
+        local_path = Path(self.config['local_folder']) / local_rel_path
+        tmp_path = self._temp_path(local_path)
         try:
             # 构建下载URL
             url = urljoin(self.config['server_url'], quote(remote_path))
-            self.log_callback(f"开始下载: {remote_path}")
+            self.logger.debug("开始下载: %s", remote_path, event='download.start', path=remote_path)
             
-            # 发送下载请求
-            response = self.session.get(url, timeout=30)
+            # 发送下载请求（流式读取，便于及时响应停止/暂停）
+            response = self.session.get(url, timeout=self.timeout, stream=True)
             response.raise_for_status()
             
             # 确保本地目录存在
-            local_path = Path(self.config['local_folder']) / remote_path
             local_path.parent.mkdir(parents=True, exist_ok=True)
             
-            # 写入文件
-            with open(local_path, 'wb') as f:
-                f.write(response.content)
+            # 先写入临时文件，完成后再替换目标文件
+            size = 0
+            total = int(response.headers.get('Content-Length') or (server_file or {}).get('size') or 0)
+            hasher = hashlib.sha256()
+            with response, open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    self.token.check()
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    if self.events is not None:
+                        self.emit(TransferProgress(self.config.get('server_url', ''), 'download', remote_path, size, total))
+            os.replace(tmp_path, local_path)
+            self.note_local_write()
+            self._record_local_hash(local_rel_path, local_path, hasher.hexdigest())
                 
-            self.log_callback(f"下载成功: {remote_path} ({len(response.content)} 字节)")
-            self.stats['downloaded'] += 1
-            self.update_stats()
+            self.logger.info("下载成功: %s (%d 字节)", remote_path, size, event='download.done', path=remote_path, size=size)
+            self.add_stat('downloaded')
+            return True
             
+        except SyncCancelled:
+            self.log_callback(f"下载已中止: {remote_path}")
+            self._remove_temp_file(tmp_path)
+            raise
         except requests.exceptions.Timeout:
-            self.log_callback(f"下载超时 {remote_path}")
+            self.logger.warning(f"下载超时 {remote_path}")
         except requests.exceptions.RequestException as e:
-            self.log_callback(f"下载网络错误 {remote_path}: {str(e)}")
+            self.logger.warning(f"下载网络错误 {remote_path}: {str(e)}")
         except OSError as e:
-            self.log_callback(f"下载文件写入错误 {remote_path}: {str(e)}")
+            self.logger.warning(f"下载文件写入错误 {remote_path}: {str(e)}")
         except Exception as e:
-            self.log_callback(f"下载失败 {remote_path}: {str(e)}")
+            self.logger.warning(f"下载失败 {remote_path}: {str(e)}")
+        finally:
+            self._remove_temp_file(tmp_path)
+        return False
             
-    def delete_server_file(self, remote_path):
-        """删除服务器文件"""
+    def _record_local_hash(self, rel_path, local_path, file_hash):
+        """记录刚写入的本地文件的hash，下一轮不必重新计算"""
+        try:
+            stat = os.stat(local_path)
+        except OSError:
+            return
+        self.hash_state.put(rel_path, stat.st_size, int(stat.st_mtime * 1000), file_hash)
+        
+    def note_local_write(self):
+        """记录本引擎刚刚修改了本地文件夹（下次取共享扫描结果时需要重新扫描）"""
+        self.last_local_write = time.time()
+        
+    @staticmethod
+    def _temp_path(local_path):
+        """下载用的临时文件路径（名称唯一，多个目标或线程同时写同一文件时互不影响）"""
+        return local_path.with_name(f".{local_path.name}.{uuid.uuid4().hex[:12]}.dufs_tmp")
+        
+    @staticmethod
+    def _remove_temp_file(tmp_path):
+        """删除未完成的临时文件"""
+        try:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        except OSError:
+            pass
+            
+    def reuse_local_content(self, remote_path, server_file):
+        """用本地已有的相同内容生成目标文件，成功返回True"""
+        mode = self.config.get('local_reuse_mode', 'copy')
+        indexed = self.local_hash_index.get(server_file.get('hash'))
+        if mode == 'off' or not indexed:
+            return False
+            
+        source, size, mtime = indexed
+        local_path = Path(self.config['local_folder']) / remote_path
+        if os.path.normcase(os.path.abspath(source)) == os.path.normcase(os.path.abspath(local_path)):
+            return False
+        tmp_path = self._temp_path(local_path)
+        try:
+            # 扫描后源文件被修改过则不能复用
+            stat = os.stat(source)
+            if stat.st_size != size or int(stat.st_mtime * 1000) != mtime:
+                return False
+                
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+            if tmp_path.exists():
+                tmp_path.unlink()
+            if mode == 'hardlink':
+                os.link(source, tmp_path)
+                method = '硬链接'
+            else:
+                method = self.clone_file(source, tmp_path)
+                
+            # 大小校验通过后才替换目标文件
+            expected_size = server_file.get('size')
+            if expected_size is not None and tmp_path.stat().st_size != expected_size:
+                raise OSError(f"大小校验失败: {tmp_path.stat().st_size} != {expected_size}")
+            os.replace(tmp_path, local_path)
+            self.note_local_write()
+            self._record_local_hash(remote_path, local_path, server_file['hash'])
+            
+            self.log_callback(f"本地复用成功（{method}）: {remote_path} <- {source}")
+            self.add_stat('downloaded')
+            return True
+            
+        except Exception as e:
+            self.logger.warning(f"本地复用失败，改为下载 {remote_path}: {str(e)}")
+            self._remove_temp_file(tmp_path)
+            return False
+            
+    @staticmethod
+    def clone_file(source, target):
+        """复制文件，Linux上优先使用reflink（不占用额外空间），返回使用的方式"""
+        if sys.platform.startswith('linux'):
+            try:
+                import fcntl
+                with open(source, 'rb') as fsrc, open(target, 'wb') as fdst:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return 'reflink'
+            except OSError:
+                pass
+        shutil.copyfile(source, target)
+        return '复制'
+        
+    def move_server_path(self, src_path, dst_path, is_dir=False):
+        """通过WebDAV MOVE在服务器上移动文件或目录"""
+        try:
+            dst_dir = '/'.join(dst_path.split('/')[:-1])
+            self.ensure_remote_directory(dst_dir)
+            
+            url = urljoin(self.config['server_url'], quote(src_path))
+            destination = urljoin(self.config['server_url'], quote(dst_path))
+            response = self.session.request('MOVE', url, headers={'Destination': destination}, timeout=self.timeout)
+            response.raise_for_status()
+            
+            if is_dir:
+                self.forget_remote_directory(src_path)
+                with self.remote_dirs_lock:
+                    self.remote_dirs.add(dst_path)
+            self.listing_cache.invalidate(src_path)
+            self.listing_cache.invalidate(dst_path)
+            self.log_callback(f"服务器移动成功: {src_path} -> {dst_path}")
+            self.add_stat('moved')
+            return True
+            
+        except Exception as e:
+            self.logger.warning(f"服务器移动失败 {src_path} -> {dst_path}: {str(e)}")
+            return False
+            
+    def move_local_path(self, src_path, dst_path):
+        """在本地移动文件或目录"""
+        try:
+            local_folder = Path(self.config['local_folder'])
+            src = local_folder / src_path
+            dst = local_folder / dst_path
+            if dst.exists():
+                raise FileExistsError(f"目标已存在: {dst_path}")
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(src, dst)
+            self.note_local_write()
+            
+            self.log_callback(f"本地移动成功: {src_path} -> {dst_path}")
+            self.add_stat('moved')
+            return True
+            
+        except Exception as e:
+            self.logger.warning(f"本地移动失败 {src_path} -> {dst_path}: {str(e)}")
+            return False
+            
+    def delete_server_file(self, remote_path, file_count=None):
+        """删除服务器文件（file_count 不为None时删除的是包含这么多文件的整个目录）"""
         try:
             url = urljoin(self.config['server_url'], quote(remote_path))
-            response = self.session.delete(url)
+            response = self.session.delete(url, timeout=self.timeout)
             response.raise_for_status()
             
-            self.log_callback(f"服务器删除成功: {remote_path}")
-            self.stats['deleted'] += 1
-            self.update_stats()
+            # 删除的是目录时，其下的所有已知目录同时失效
+            self.forget_remote_directory(remote_path)
+            self.listing_cache.invalidate(remote_path)
+            if file_count is None:
+                self.log_callback(f"服务器删除成功: {remote_path}")
+            else:
+                self.log_callback(f"服务器删除目录成功: {remote_path} ({file_count} 个文件)")
+            self.add_stat('deleted', file_count or 1)
+            return True
             
         except Exception as e:
-            self.log_callback(f"服务器删除失败 {remote_path}: {str(e)}")
+            self.logger.warning(f"服务器删除失败 {remote_path}: {str(e)}")
+            return False
             
-    def delete_local_file(self, local_path):
-        """删除本地文件"""
+    def delete_local_file(self, local_path, file_count=None):
+        """删除本地文件（file_count 不为None时删除的是包含这么多文件的整个目录）"""
         try:
-            os.remove(local_path)
-            self.log_callback(f"本地删除成功: {local_path}")
-            self.stats['deleted'] += 1
-            self.update_stats()
+            if file_count is None:
+                os.remove(local_path)
+                self.log_callback(f"本地删除成功: {local_path}")
+            else:
+                shutil.rmtree(local_path)
+                self.log_callback(f"本地删除目录成功: {local_path} ({file_count} 个文件)")
+            self.note_local_write()
+            self.add_stat('deleted', file_count or 1)
+            return True
             
         except Exception as e:
-            self.log_callback(f"本地删除失败 {local_path}: {str(e)}")
+            self.logger.warning(f"本地删除失败 {local_path}: {str(e)}")
+            return False
             
+    def ensure_local_hash(self, local_file):
+        """计算尚未知道hash的本地文件的hash，并记录到hash状态和本地内容索引"""
+        if local_file.get('hash') is None:
+            local_file['hash'] = self.get_file_hash(local_file['full_path'])
+            if local_file['hash']:
+                self.hash_state.put(local_file['path'], local_file['size'], local_file['mtime'], local_file['hash'])
+                self.local_hash_index.setdefault(
+                    local_file['hash'], (local_file['full_path'], local_file['size'], local_file['mtime']))
+        return local_file['hash']
+        
+    def resolve_local_hashes(self, local_files):
+        """只为可能与服务器内容相同的本地文件计算hash
+
+        大小与服务器上所有文件都不同的本地文件不可能与服务器内容相同（不会被跳过、移动、
+        服务器端复制或本地复用），它们的hash在上传时边传输边计算，不需要单独读一遍。
+        本轮待上传的文件之间大小相同时也先计算hash，以便相同内容只上传一次。
+        """
+        pending = [f for f in local_files if f.get('hash') is None]
+        same_size = {}
+        if self.config.get('dedup_uploads', True):
+            for local_file in pending:
+                same_size[local_file['size']] = same_size.get(local_file['size'], 0) + 1
+        for local_file in pending:
+            if local_file['size'] in self.server_sizes or same_size.get(local_file['size'], 0) > 1:
+                self.token.check()
+                self.ensure_local_hash(local_file)
+                
     def get_file_hash(self, file_path):
         """计算文件SHA256哈希值"""
         try:
             hash_sha256 = hashlib.sha256()
             with open(file_path, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
+                for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                    self.token.check()
+                    self.governor.wait_if_busy()
+                    self.governor.throttle(len(chunk))
                     hash_sha256.update(chunk)
             return hash_sha256.hexdigest()
+        except SyncCancelled:
+            raise
         except Exception:
             return None
             
@@ -460,7 +2087,7 @@ class SyncEngine:
                 
             # 使用fnmatch进行模式匹配
             if fnmatch.fnmatch(filename, rule):
-                self.log_callback(f"文件被排除: {filename} (匹配规则: {rule})")
+                self.logger.debug("文件被排除: %s (匹配规则: %s)", filename, rule, event='local.excluded', path=filename)
                 return True
                 
         return False
@@ -477,13 +2104,28 @@ class SyncEngine:
                 
             # 常见规则修复建议
             if rule == "~$.*":
-                self.log_callback(f"⚠️ 排除规则建议: '{rule}' 可能不会按预期工作，建议使用 '~$*' 或 '~$*.*'")
+                self.logger.warning(f"⚠️ 排除规则建议: '{rule}' 可能不会按预期工作，建议使用 '~$*' 或 '~$*.*'")
                 
             fixed_rules.append(rule)
             
         return fixed_rules
         
+    def add_stat(self, key, amount=1):
+        """累加统计项（传输可能在多个线程中并行执行）"""
+        with self.stats_lock:
+            self.stats[key] += amount
+        self.update_stats()
+        
     def update_stats(self):
         """更新统计信息"""
         if self.stats_callback:
-            self.stats_callback(self.stats)
\ No newline at end of file
+            self.stats_callback(self.stats)
+        if self.events is not None:
+            with self.stats_lock:
+                stats = dict(self.stats)
+            self.emit(StatsUpdated(self.config.get('server_url', ''), stats))
+            
+    def emit(self, event):
+        """发布结构化事件（不阻塞）"""
+        if self.events is not None:
+            self.events.put(event)
\ No newline at end of file
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+同步事件 - 负责以结构化事件的形式向界面或其他程序报告同步进度
+"""
+
+import time
+import itertools
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+# 事件队列默认最多保留的事件数
+DEFAULT_QUEUE_SIZE = 10000
+
+@dataclass
+class SyncEvent:
+    """所有事件的基类：target 为服务器地址，time 为事件发生的时间戳"""
+    target: str
+    time: float = field(default_factory=time.time, init=False)
+
+    def coalesce_key(self):
+        """相同键的事件在被取走前只保留最新的一个，None 表示不合并"""
+        return None
+
+@dataclass
+class LogMessage(SyncEvent):
+    """日志消息（level 为 debug/info/warning/error）"""
+    level: str
+    message: str
+
+@dataclass
+class ScanProgress(SyncEvent):
+    """扫描进度：side 为 'local' 或 'server'，files 为目前已发现的文件数"""
+    side: str
+    files: int
+
+    def coalesce_key(self):
+        return ('scan', self.target, self.side)
+
+@dataclass
+class PlanReady(SyncEvent):
+    """一批同步计划已生成（流式模式下每批一个），counts 为各类操作的数量"""
+    counts: dict
+
+@dataclass
+class TransferStarted(SyncEvent):
+    """开始传输：kind 为 upload/download/conflict"""
+    kind: str
+    path: str
+    size: int
+
+@dataclass
+class TransferProgress(SyncEvent):
+    """传输进度（同一文件只保留最新的一个）"""
+    kind: str
+    path: str
+    done: int
+    total: int
+
+    def coalesce_key(self):
+        return ('transfer', self.target, self.path)
+
+@dataclass
+class TransferFinished(SyncEvent):
+    """传输结束：success 为是否成功，elapsed 为耗时秒数"""
+    kind: str
+    path: str
+    success: bool
+    elapsed: float
+
+@dataclass
+class StatsUpdated(SyncEvent):
+    """累计统计（uploaded/downloaded/deleted/moved）"""
+    stats: dict
+
+    def coalesce_key(self):
+        return ('stats', self.target)
+
+@dataclass
+class SyncError(SyncEvent):
+    """一轮同步因错误中断"""
+    message: str
+
+@dataclass
+class CycleSummary(SyncEvent):
+    """一轮同步结束：scope 为同步的子目录，status 为 ok/cancelled/error"""
+    scope: str
+    status: str
+    elapsed: float
+    stats: dict
+
+class EventQueue:
+    """有界、不阻塞生产者的事件队列
+
+    put() 从不等待：进度类事件按 coalesce_key 合并（替换队列中尚未取走的旧事件，位置不变），
+    队列已满时丢弃最旧的事件并计入 dropped。消费者用 get()/drain() 取事件，或直接迭代
+    （阻塞到 close() 为止）。
+    """
+
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, event):
+        """加入事件（不阻塞）"""
+        key = event.coalesce_key()
+        with self.condition:
+            if key is not None and key in self.items:
+                self.items[key] = event
+                return
+            if len(self.items) >= self.maxsize:
+                self.items.popitem(last=False)
+                self.dropped += 1
+            self.items[key if key is not None else next(self.counter)] = event
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """取出最早的事件，超时或队列已关闭且为空时返回None"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.items or self.closed, timeout)
+            if not self.items:
+                return None
+            return self.items.popitem(last=False)[1]
+
+    def drain(self, limit=None):
+        """不等待，取出当前所有（最多 limit 个）事件"""
+        events = []
+        with self.condition:
+            while self.items and (limit is None or len(events) < limit):
+                events.append(self.items.popitem(last=False)[1])
+        return events
+
+    def close(self):
+        """不再有新事件，唤醒等待中的消费者"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __iter__(self):
+        while True:
+            event = self.get()
+            if event is None:
+                return
+            yield event
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+同步日志 - 负责记录同步计划和执行进度，中断后可以继续未完成的计划
+"""
+
+import json
+import os
+import threading
+from .config_manager import get_state_path
+
+# 计划中记录的操作类型
+JOURNAL_KINDS = ('upload', 'download', 'conflict', 'delete_server', 'delete_local')
+
+class SyncJournal:
+    """只追加的同步日志（每行一条JSON记录）
+
+    记录类型：
+    - plan: 一批同步计划，包含每个操作及计划时的本地/服务器文件状态（整个目录的删除另有文件数 files）
+    - done: 某个操作已成功完成
+    本轮同步正常结束时清空日志；进程中途退出时日志中留有未完成的计划，下次启动时先继续执行这些操作。
+    """
+
+    def __init__(self, server_url, local_folder):
+        self.journal_file = get_state_path('journal', server_url.rstrip('/'), str(local_folder), suffix='.log')
+        self.lock = threading.Lock()
+        self.plan_count = 0
+
+    def _append(self, record, sync=False):
+        """追加一条记录"""
+        with self.lock:
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def record_plan(self, sync_actions):
+        """记录一批同步计划，并给每个操作分配编号"""
+        plan_id = self.plan_count
+        self.plan_count += 1
+        items = []
+        for kind in JOURNAL_KINDS:
+            for item in sync_actions.get(kind, []):
+                item['journal_id'] = [plan_id, len(items)]
+                record = {
+                    'kind': kind,
+                    'path': item['path'],
+                    'local': _file_state(item.get('local')),
+                    'server': _file_state(item.get('server'))
+                }
+                if item.get('files') is not None:
+                    # 合并为整个目录的删除，记录目录中的文件数
+                    record['files'] = item['files']
+                items.append(record)
+        if items:
+            self._append({'type': 'plan', 'plan': plan_id, 'items': items}, sync=True)
+
+    def record_done(self, item):
+        """记录一个操作已完成"""
+        journal_id = item.get('journal_id')
+        if journal_id:
+            self._append({'type': 'done', 'plan': journal_id[0], 'id': journal_id[1]})
+
+    def record_end(self):
+        """本轮同步正常结束，清空日志"""
+        with self.lock:
+            self.plan_count = 0
+            try:
+                if self.journal_file.exists():
+                    self.journal_file.unlink()
+            except OSError:
+                pass
+
+    def load_pending(self):
+        """读取上次未完成的操作，返回 [{'kind', 'path', 'local', 'server'[, 'files']}]"""
+        if not self.journal_file.exists():
+            return []
+        plans = {}
+        done = set()
+        try:
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 进程中途退出时最后一行可能不完整
+                        continue
+                    if record.get('type') == 'plan':
+                        plans[record['plan']] = record['items']
+                    elif record.get('type') == 'done':
+                        done.add((record['plan'], record['id']))
+        except OSError:
+            return []
+
+        pending = []
+        for plan_id in sorted(plans):
+            for index, item in enumerate(plans[plan_id]):
+                if (plan_id, index) not in done:
+                    pending.append(item)
+        return pending
+
+def _file_state(info):
+    """提取计划时的文件状态，用于恢复时的校验"""
+    if not info:
+        return None
+    return {'size': info.get('size'), 'mtime': info.get('mtime'), 'hash': info.get('hash')}
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+同步日志 - 负责分级日志、界面日志回调和后台写入的日志文件
+"""
+
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from pathlib import Path
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from .config_manager import CONFIG_DIR
+from .sync_events import LogMessage
+
+LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR
+}
+
+# 所有同步引擎共用的日志记录器，只输出到日志文件（界面由各引擎的回调负责）
+logger = logging.getLogger('dufs_sync')
+logger.propagate = False
+logger.setLevel(logging.CRITICAL + 1)
+
+_file_lock = threading.Lock()
+_file_handler = None
+_listener = None
+_file_settings = None
+
+def parse_level(name, default=logging.INFO):
+    """把配置中的级别名称转换为 logging 的级别"""
+    return LOG_LEVELS.get(str(name).lower(), default)
+
+class JsonLineFormatter(logging.Formatter):
+    """日志文件每行一条JSON记录：时间、级别、目标服务器、事件、消息和附加字段"""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname.lower(),
+            'target': getattr(record, 'target', ''),
+            'event': getattr(record, 'event', None),
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def configure_file_logging(config):
+    """按配置启用或关闭日志文件（可重复调用，设置不变时不做任何事）
+
+    日志记录通过队列交给后台线程写入文件，同步线程不等待磁盘I/O。
+    """
+    global _file_handler, _listener, _file_settings
+    level = parse_level(config.get('log_file_level', 'info'))
+    path = config.get('log_file') or str(CONFIG_DIR / 'logs' / 'sync.log')
+    max_bytes = int(float(config.get('log_file_max_mb', 10)) * 1024 * 1024)
+    backups = int(config.get('log_file_backups', 3))
+    settings = (config.get('log_to_file', True), level, path, max_bytes, backups)
+
+    with _file_lock:
+        if settings == _file_settings:
+            return
+        _stop_listener()
+        _file_settings = settings
+        if not settings[0]:
+            return
+        try:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        except OSError:
+            return
+        file_handler.setFormatter(JsonLineFormatter())
+        log_queue = queue.SimpleQueue()
+        _file_handler = QueueHandler(log_queue)
+        _listener = QueueListener(log_queue, file_handler)
+        _listener.start()
+        logger.addHandler(_file_handler)
+        logger.setLevel(level)
+
+def _stop_listener():
+    """停止后台写入线程，写完队列中剩余的记录"""
+    global _file_handler, _listener
+    if _file_handler is not None:
+        logger.removeHandler(_file_handler)
+        _file_handler = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    logger.setLevel(logging.CRITICAL + 1)
+
+def shutdown_file_logging():
+    """程序退出前关闭日志文件"""
+    global _file_settings
+    with _file_lock:
+        _stop_listener()
+        _file_settings = None
+
+atexit.register(shutdown_file_logging)
+
+class SyncLogger:
+    """同步引擎的分级日志
+
+    - 达到 log_level 的消息交给界面回调和事件队列（默认 info，逐个文件的细节为 debug）；
+    - 达到 log_file_level 的消息写入日志文件（见 configure_file_logging）。
+    消息使用 % 格式的参数，两边都不需要时不格式化，也不调用回调。
+    event 和其他关键字参数作为结构化字段写入日志文件。
+    """
+
+    def __init__(self, config, callback, target='', events=None):
+        self.callback = callback
+        self.events = events
+        self.callback_level = parse_level(config.get('log_level', 'info'))
+        self.target = target
+
+    def enabled(self, level):
+        """该级别的消息是否会输出到任何地方"""
+        return ((self.callback is not None or self.events is not None) and level >= self.callback_level) \
+            or logger.isEnabledFor(level)
+
+    def log(self, level, msg, *args, event=None, **fields):
+        to_callback = (self.callback is not None or self.events is not None) and level >= self.callback_level
+        to_file = logger.isEnabledFor(level)
+        if not (to_callback or to_file):
+            return
+        if to_file:
+            logger.log(level, msg, *args, extra={'target': self.target, 'event': event, 'fields': fields})
+        if to_callback:
+            message = msg % args if args else msg
+            if self.callback is not None:
+                self.callback(message)
+            if self.events is not None:
+                self.events.put(LogMessage(self.target, logging.getLevelName(level).lower(), message))
+
+    def debug(self, msg, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.log(logging.WARNING, msg, *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.log(logging.ERROR, msg, *args, **kwargs)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+传输调度器 - 负责决定上传/下载的执行顺序
+"""
+
+import fnmatch
+import heapq
+import itertools
+import threading
+
+class TransferScheduler:
+    """按可配置规则排序的传输队列
+
+    排序规则（依次比较）：
+    1. 路径优先级：匹配 schedule_priority_patterns 中越靠前的规则优先级越高，未匹配的最低
+    2. 小文件优先（schedule_small_first）
+    3. 最近修改优先（schedule_recent_first）
+
+    大于 large_file_threshold 的文件进入单独的大文件通道：顺序执行时每处理
+    large_lane_ratio 个小文件穿插一个大文件；多线程执行时第一个工作线程专门处理大文件，
+    大文件不会饿死，也不会阻塞小文件。
+    """
+
+    def __init__(self, config):
+        self.patterns = [p.strip() for p in config.get('schedule_priority_patterns', []) if p.strip()]
+        self.small_first = config.get('schedule_small_first', True)
+        self.recent_first = config.get('schedule_recent_first', False)
+        self.large_threshold = config.get('large_file_threshold', 64 * 1024 * 1024)
+        self.large_ratio = max(1, config.get('large_lane_ratio', 10))
+        self.small_queue = []
+        self.large_queue = []
+        self.small_since_large = 0
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.small_queue) + len(self.large_queue)
+
+    def priority_class(self, path):
+        """返回路径匹配的优先级序号，未匹配时排在最后"""
+        name = path.rsplit('/', 1)[-1]
+        for index, pattern in enumerate(self.patterns):
+            if fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(name, pattern):
+                return index
+        return len(self.patterns)
+
+    def push(self, kind, item):
+        """加入一个传输任务，kind 为 upload/download/conflict"""
+        info = item.get('server') if kind == 'download' else item.get('local')
+        info = info or {}
+        size = info.get('size') or 0
+        mtime = info.get('mtime') or 0
+        key = (
+            self.priority_class(item['path']),
+            size if self.small_first else 0,
+            -mtime if self.recent_first else 0,
+            next(self.counter)
+        )
+        queue = self.large_queue if size >= self.large_threshold else self.small_queue
+        with self.lock:
+            heapq.heappush(queue, (key, kind, item))
+
+    def pop(self, lane=None):
+        """取出下一个任务，队列为空时返回 (None, None)
+
+        lane 为 'large' 时优先取大文件，为 'small' 时优先取小文件，
+        为 None 时按 large_lane_ratio 交替。
+        """
+        with self.lock:
+            if lane == 'large':
+                order = (self.large_queue, self.small_queue)
+            elif lane == 'small':
+                order = (self.small_queue, self.large_queue)
+            elif self.large_queue and (not self.small_queue or self.small_since_large >= self.large_ratio):
+                order = (self.large_queue, self.small_queue)
+            else:
+                order = (self.small_queue, self.large_queue)
+
+            for queue in order:
+                if queue:
+                    _, kind, item = heapq.heappop(queue)
+                    if queue is self.large_queue:
+                        self.small_since_large = 0
+                    else:
+                        self.small_since_large += 1
+                    return kind, item
+            return None, None
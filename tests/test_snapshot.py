@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列式文件快照的测试
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gui.snapshot import PathTable, FileSnapshot, diff_snapshots, write_snapshot
+
+HASH = 'ab' * 32
+
+class InvalidDigestTest(unittest.TestCase):
+    """服务器返回的hash不是64位十六进制时按未知处理，不能让整个同步失败"""
+
+    INVALID = ['file body, not a hash', 'zz' * 32, 'ab' * 16, 'ab ' * 21 + 'a', '']
+
+    def test_build_treats_invalid_hash_as_unknown(self):
+        rows = [(f'f{i}', 1, 2, value) for i, value in enumerate(self.INVALID)]
+        snapshot = FileSnapshot.build(PathTable(), rows + [('ok', 1, 2, HASH)])
+        self.assertEqual([snapshot.digest(i) for i in range(len(self.INVALID))], [None] * len(self.INVALID))
+        self.assertEqual(snapshot.digest(len(self.INVALID)), HASH)
+
+    def test_invalid_hashes_are_never_identical(self):
+        table = PathTable()
+        local = FileSnapshot.from_local_files(table, [
+            {'path': 'a.txt', 'size': 3, 'mtime': 1, 'hash': HASH},
+            {'path': 'b.txt', 'size': 3, 'mtime': 1, 'hash': HASH},
+        ])
+        server = FileSnapshot.from_server_files(table, {
+            'a.txt': {'size': 3, 'mtime': 1, 'hash': HASH},
+            'b.txt': {'size': 3, 'mtime': 1, 'hash': 'OLD'},
+        })
+        diff = diff_snapshots(local, server)
+        self.assertEqual([local.path(i) for i in diff.same_local], ['a.txt'])
+        self.assertEqual(sorted(table.paths[i] for i in diff.other_ids), ['b.txt'])
+
+    def test_write_snapshot_treats_invalid_hash_as_unknown(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = os.path.join(tmp, 'state.snap')
+            write_snapshot(file_path, [('a', 1, 2, 'not a hash'), ('b', 1, 2, HASH)])
+            snapshot = FileSnapshot.load(file_path)
+            try:
+                self.assertEqual(snapshot.digest(snapshot.find('a')), None)
+                self.assertEqual(snapshot.digest(snapshot.find('b')), HASH)
+            finally:
+                snapshot.close()
+
+if __name__ == '__main__':
+    unittest.main()